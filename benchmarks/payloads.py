@@ -0,0 +1,101 @@
+"""
+Synthetic payloads shaped like those of the WSN server, for benchmarking.
+"""
+
+import numpy as np
+
+from wsn_client import var_dict
+
+
+# Columns of finseflux_Biomet
+COLUMNS = list(var_dict.CR6_biomet_perm)
+METADATA = {
+    'model': 'CR6',
+    'name': 'finseflux',
+    'os_version': 'CR6.Std.11.00',
+    'prog_name': 'CPU:Finse_Biomet.CR6',
+    'prog_signature': 12345,
+    'serial': var_dict.CR6_serials['finse_stationnary'],
+    'table_name': 'Biomet',
+}
+
+START = 1514764800 # 2018-01-01
+STEP = 60
+
+
+def generate_columns(rows, seed=0):
+    """
+    Returns a dictionary with the values of every column, as numpy arrays or
+    constants.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name in COLUMNS:
+        if name == 'time':
+            columns[name] = START + np.arange(rows, dtype='int64') * STEP
+        elif name == 'RECORD':
+            columns[name] = np.arange(rows, dtype='int64')
+        elif name in METADATA:
+            columns[name] = METADATA[name]
+        else:
+            columns[name] = rng.normal(100, 50, rows).round(4)
+
+    return columns
+
+
+def generate(rows, format='dense', sparsity=0.8, seed=0):
+    """
+    Returns a payload of /api/query/ with the given number of rows, in the
+    dense format (finseflux_Biomet, ClickHouse) or in the sparse format (as
+    PostgreSQL sources return, where every row has only some of the fields).
+    """
+    columns = generate_columns(rows, seed)
+    names = ['time'] + [x for x in COLUMNS if x != 'time']
+    arrays = [
+        columns[name].tolist() if isinstance(columns[name], np.ndarray)
+        else [columns[name]] * rows
+        for name in names
+    ]
+
+    if format == 'dense':
+        return {'format': 'dense', 'columns': names, 'rows': [list(row) for row in zip(*arrays)]}
+
+    # Sparse: every field is missing with the probability given by sparsity
+    rng = np.random.default_rng(seed + 1)
+    present = rng.random((rows, len(names))) >= sparsity
+    present[:, 0] = True # time
+    data = []
+    for i, row in enumerate(zip(*arrays)):
+        mask = present[i]
+        data.append({name: value for name, value, keep in zip(names, row, mask) if keep})
+
+    return {'format': 'sparse', 'rows': data}
+
+
+def to_arrow_table(payload):
+    """
+    Returns the payload as an Arrow table, with the time as Unix timestamps,
+    as the server sends it. In the sparse format the columns are those of all
+    the rows.
+    """
+    from wsn_client.query import to_arrow
+
+    return to_arrow(payload, time_index=False)
+
+
+def qc_records(rows, seed=0):
+    """
+    Returns the records of /api/qc/download/
+    """
+    rng = np.random.default_rng(seed)
+    times = (START + np.arange(rows, dtype='int64') * 600).tolist()
+    temperature = rng.normal(0, 10, rows).round(4).tolist()
+    humidity = rng.uniform(0, 100, rows).round(4).tolist()
+    return [
+        {
+            'time': t,
+            'temperature': x, 'temperature_qc': False,
+            'humidity': y, 'humidity_qc': False,
+        }
+        for t, x, y in zip(times, temperature, humidity)
+    ]
@@ -0,0 +1,269 @@
+"""
+Benchmarks the client against the local stand-in server, e.g.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --rows 1000 100000 1000000 --kinds dense --wire json arrow
+    python -m benchmarks.run --rows 1000000 --kinds dense --wire json --stream all
+    python -m benchmarks.run --rows 100000 --kinds dense sparse --modes get chunk iter cache
+
+For every case (number of rows, payload kind, wire format, compression and
+output format, and JSON streaming) it reports the wall time, split in download, decode (parse)
+and build (conversion to the output format), the bytes transferred, and the
+peak RSS of the process. Every case runs in a fresh process, so the peak RSS
+is that of the case alone.
+
+The modes are the code paths measured, for the dense and sparse payloads:
+
+- get: a single request, decoded and converted
+- query: query(), one request for the time range of the rows
+- chunk: query(chunk=...), the time range split in --parts chunks
+- iter: iter_query(), with pages of rows / --parts rows
+- cache: query(cache=...) with the cache already filled (the time is that of
+  the second call)
+
+With iter the time is not split, and the bytes are not reported.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import importlib.util
+import datetime
+import itertools
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+
+from . import payloads, server
+
+
+OUTPUTS = {
+    'pandas': 'pandas',
+    'json': None,
+    'arrow': 'pyarrow',
+    'polars': 'polars',
+}
+
+WIRE = {
+    'json': None,
+    'msgpack': 'msgpack',
+    'arrow': 'pyarrow',
+}
+
+
+def is_available(module):
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def get_rss():
+    """
+    Peak RSS of this process, in MiB.
+    """
+    # On Linux ru_maxrss survives exec, so it would include the peak of the
+    # parent (with the payloads in memory), VmHWM does not
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except FileNotFoundError:
+        pass
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 2 ** 20 # bytes
+    return rss / 2 ** 10 # KiB
+
+
+MODES = ['get', 'query', 'chunk', 'iter', 'cache']
+
+
+def from_timestamp(x):
+    return datetime.datetime.fromtimestamp(x, datetime.timezone.utc)
+
+
+def run_query(client, kind, rows, output, mode, parts, stream=False):
+    """
+    Runs the case through query() or iter_query(), returns the times and the
+    bytes transferred (None if unknown).
+    """
+    from wsn_client.cache import Cache
+
+    db = 'clickhouse' if kind == 'dense' else 'postgresql'
+    params = dict(
+        table='finseflux_Biomet', limit=None,
+        time__gte=from_timestamp(payloads.START),
+        time__lte=from_timestamp(payloads.START + (rows - 1) * payloads.STEP),
+        format=output or 'json', time_index=False,
+    )
+
+    if mode == 'iter':
+        t0 = time.perf_counter()
+        n = 0
+        for page in client.iter_query(db, page_size=max(rows // parts, 1), **params):
+            n += len(page['rows']) if output == 'json' else len(page)
+        total = time.perf_counter() - t0
+        times = {'download': None, 'decode': None, 'build': None, 'total': total}
+        return times, None, n
+
+    if mode == 'chunk':
+        params['chunk'] = max(rows // parts, 1) * payloads.STEP
+    elif mode == 'cache':
+        # Removed when the process ends
+        path = tempfile.TemporaryDirectory()
+        params['cache'] = Cache(path.name)
+        client.query(db, **params)
+
+    stats = []
+    result = client.query(db, hook=stats.append, stream=stream, **params)
+    stats = stats[0]
+    times = {
+        'download': stats.connect + stats.wait + stats.download,
+        'decode': stats.decode,
+        'build': stats.build + stats.index,
+        'total': stats.total,
+    }
+    n = len(result['rows']) if output == 'json' else len(result)
+    return times, stats.bytes, n
+
+
+def run_case(url, kind, rows, wire, compress, output, stream=False, mode='get', parts=8):
+    from wsn_client.client import WSNClient, decode
+    from wsn_client.query import convert, get_params
+    from wsn_client.qc import normalize
+    from wsn_client.stats import Stats
+
+    rss0 = get_rss()
+
+    client = WSNClient(host=url, token='benchmark', api_key='benchmark', formats=[wire])
+    if not compress:
+        client.session.headers['Accept-Encoding'] = 'identity'
+
+    if mode != 'get':
+        times, size, n = run_query(client, kind, rows, output, mode, parts, stream)
+        return {
+            'rows': rows, 'kind': kind, 'wire': wire, 'gzip': compress, 'output': output,
+            'stream': stream, 'mode': mode, 'bytes': size, **times,
+            'rss': get_rss(), 'rss_delta': get_rss() - rss0, 'result_rows': n,
+        }
+
+    if kind == 'qc':
+        path, auth, params = '/api/qc/download/benchmark/', 'api_key', {'limit': rows}
+    else:
+        db = 'clickhouse' if kind == 'dense' else 'postgresql'
+        path, auth = f'/api/query/{db}/', 'token'
+        params = get_params(table='finseflux_Biomet', limit=rows)
+
+    t0 = time.perf_counter()
+    if stream:
+        # Download and decoding overlap, the download time includes most of
+        # the decoding
+        stats = Stats()
+        response, data = client.get(client.url(path), params, auth, stats=stats, stream=stream)
+        if kind == 'qc':
+            data = normalize(data)
+        t2 = time.perf_counter()
+        t1 = t2 - stats.decode
+    else:
+        response = client.session.get(client.url(path), params=params,
+                                      headers=client.get_auth(auth))
+        response.raise_for_status()
+        body = response.content
+        t1 = time.perf_counter()
+        data = decode(response.headers.get('Content-Type'), body)
+        if kind == 'qc':
+            data = normalize(data)
+        del body
+        t2 = time.perf_counter()
+    result = convert(data, output or 'json')
+    t3 = time.perf_counter()
+
+    return {
+        'rows': rows, 'kind': kind, 'wire': wire, 'gzip': compress, 'output': output,
+        'stream': stream, 'mode': mode,
+        'bytes': int(response.headers['Content-Length']),
+        'download': t1 - t0, 'decode': t2 - t1, 'build': t3 - t2, 'total': t3 - t0,
+        'rss': get_rss(), 'rss_delta': get_rss() - rss0,
+        'result_rows': len(result['rows']) if output == 'json' else len(result),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the WSN client')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--kinds', nargs='+', default=['dense', 'sparse', 'qc'],
+                        choices=['dense', 'sparse', 'qc'])
+    parser.add_argument('--wire', nargs='+', default=list(WIRE), choices=list(WIRE))
+    parser.add_argument('--outputs', nargs='+', default=list(OUTPUTS), choices=list(OUTPUTS))
+    parser.add_argument('--gzip', choices=['no', 'yes', 'both'], default='no')
+    parser.add_argument('--stream', choices=['no', 'yes', 'process', 'all'], default='no',
+                        help='Decode JSON while downloading (see wsn_client.stream)')
+    parser.add_argument('--modes', nargs='+', default=['get'], choices=MODES,
+                        help='Code paths to measure (see above), get by default')
+    parser.add_argument('--parts', type=int, default=8,
+                        help='Number of chunks (chunk) or pages (iter)')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    wires = [x for x in args.wire if is_available(WIRE[x])]
+    outputs = [x for x in args.outputs if is_available(OUTPUTS[x])]
+    compress = {'no': [False], 'yes': [True], 'both': [False, True]}[args.gzip]
+    streams = {'no': [False], 'yes': [True], 'process': ['process'],
+               'all': [False, True, 'process']}[args.stream]
+
+    cases = []
+    for rows, kind, wire, gz, output, stream, mode in itertools.product(
+            args.rows, args.kinds, wires, compress, outputs, streams, args.modes):
+        if kind == 'qc' and (wire != 'json' or mode != 'get'):
+            continue
+        if stream and (wire != 'json' or mode == 'iter'):
+            continue
+        cases.append((kind, rows, wire, gz, output, stream, mode))
+
+    srv, url = server.start(size=max(args.rows))
+
+    # Generate the datasets and the payloads of get before, so it's not measured
+    for kind, rows, wire, gz, output, stream, mode in cases:
+        srv.payloads.get_data(kind)
+        if mode == 'get':
+            content_type = server.JSON if kind == 'qc' else server.CONTENT_TYPES[wire][0]
+            srv.payloads.get(kind, content_type, gz, limit=rows)
+
+    def format_time(x):
+        return f'{"-":>8}' if x is None else f'{x:8.3f}'
+
+    header = (f'{"rows":>9} {"kind":6} {"wire":7} {"gzip":4} {"output":6} {"stream":7} '
+              f'{"mode":5} {"MiB":>8} '
+              f'{"download":>8} {"decode":>8} {"build":>8} {"total":>8} {"RSS MiB":>8}')
+    print(header)
+    print('-' * len(header))
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for kind, rows, wire, gz, output, stream, mode in cases:
+        # Not a Pool, its workers are daemonic and cannot start the decoding
+        # process of stream='process'
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            result = executor.submit(run_case, url, kind, rows, wire, gz, output, stream,
+                                     mode, args.parts).result()
+
+        results.append(result)
+        size = result['bytes']
+        size = f'{"-":>8}' if size is None else f'{size / 2 ** 20:8.2f}'
+        print(f'{rows:9d} {kind:6} {wire:7} {"yes" if gz else "no":4} {output:6} '
+              f'{stream or "no"!s:7} {mode:5} {size} '
+              f'{format_time(result["download"])} {format_time(result["decode"])} '
+              f'{format_time(result["build"])} {format_time(result["total"])} '
+              f'{result["rss"]:8.1f}')
+
+    srv.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
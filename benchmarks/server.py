@@ -0,0 +1,232 @@
+"""
+Local stand-in for the WSN server, serving synthetic payloads:
+
+- GET /api/query/clickhouse/ dense payloads (finseflux_Biomet)
+- GET /api/query/postgresql/ sparse payloads
+- GET /api/qc/download/{name}/ QC records
+- POST /api/qc/upload/ accepts anything (gzipped or not)
+
+Every kind of payload is a dataset of a given size (rows, one per minute since
+2018-01-01), generated once. The query parameters time__gte, time__lte, fields
+and limit select the rows and columns returned, as the server does, so chunked
+queries, the cache and iter_query work against it. Intervals are not
+supported.
+
+The payload is encoded as JSON, MessagePack or Arrow IPC stream, depending on
+the Accept header, and gzipped if the Accept-Encoding header allows it. The
+last bodies encoded are kept in memory.
+
+Run it standalone with:
+
+    python -m benchmarks.server --port 8000
+"""
+
+import argparse
+from collections import OrderedDict
+import gzip
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from wsn_client.client import CONTENT_TYPES
+
+from . import payloads
+
+
+ARROW = CONTENT_TYPES['arrow'][0]
+MSGPACK = CONTENT_TYPES['msgpack'][0]
+JSON = CONTENT_TYPES['json'][0]
+
+# Default number of rows of the datasets
+SIZE = 100000
+
+
+class Payloads:
+
+    def __init__(self, size=SIZE, maxsize=64):
+        self.size = size
+        self.maxsize = maxsize
+        self.data = {}
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_data(self, kind):
+        with self.lock:
+            data = self.data.get(kind)
+            if data is None:
+                if kind == 'qc':
+                    data = payloads.qc_records(self.size)
+                else:
+                    data = payloads.generate(self.size, kind)
+                self.data[kind] = data
+
+        return data
+
+    def select(self, kind, time__gte=None, time__lte=None, fields=None, limit=None):
+        """
+        Returns the payload with the rows within the time range (closed), and
+        only the given fields (and the time), up to the limit.
+        """
+        data = self.get_data(kind)
+        if kind == 'qc':
+            return data[:limit]
+
+        # One row per STEP seconds since START
+        i = 0 if time__gte is None else max(-(-(time__gte - payloads.START) // payloads.STEP), 0)
+        j = self.size if time__lte is None else (time__lte - payloads.START) // payloads.STEP + 1
+        j = max(min(j, self.size), i)
+        if limit is not None:
+            j = min(j, i + limit)
+
+        if data['format'] == 'sparse':
+            rows = data['rows'][i:j]
+            if fields is not None:
+                keep = {'time', *fields}
+                rows = [{k: v for k, v in row.items() if k in keep} for row in rows]
+            return {'format': 'sparse', 'rows': rows}
+
+        columns = data['columns']
+        rows = data['rows'][i:j]
+        if fields is not None:
+            index = [0] + [columns.index(x) for x in fields if x in columns and x != 'time']
+            columns = [columns[k] for k in index]
+            rows = [[row[k] for k in index] for row in rows]
+        return {'format': 'dense', 'columns': columns, 'rows': rows}
+
+    def get(self, kind, content_type, compress, **params):
+        key = (kind, content_type, compress, json.dumps(params, sort_keys=True))
+        with self.lock:
+            body = self.cache.get(key)
+            if body is not None:
+                self.cache.move_to_end(key)
+                return body
+
+        body = self.build(self.select(kind, **params), content_type, compress)
+        with self.lock:
+            self.cache[key] = body
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+
+        return body
+
+    def build(self, data, content_type, compress):
+        if content_type == ARROW:
+            import pyarrow as pa
+
+            table = payloads.to_arrow_table(data)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            body = sink.getvalue().to_pybytes()
+        elif content_type == MSGPACK:
+            import msgpack
+            body = msgpack.packb(data)
+        else:
+            body = json.dumps(data).encode()
+
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+
+        return body
+
+
+def get_params(query):
+    """
+    Returns the parameters of the query string used to select the payload.
+    """
+    query = urllib.parse.parse_qs(query)
+    get_int = lambda name: int(query[name][0]) if name in query else None
+    return {
+        'time__gte': get_int('time__gte'),
+        'time__lte': get_int('time__lte'),
+        'fields': query.get('fields'),
+        'limit': get_int('limit'),
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def get_content_type(self):
+        accept = self.headers.get('Accept', '')
+        for content_type in (ARROW, MSGPACK):
+            if content_type in accept:
+                return content_type
+        return JSON
+
+    def send(self, body, content_type=JSON, compressed=False):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = get_params(url.query)
+
+        if url.path == '/api/query/clickhouse/':
+            kind = 'dense'
+        elif url.path == '/api/query/postgresql/':
+            kind = 'sparse'
+        elif url.path.startswith('/api/qc/download/'):
+            kind = 'qc'
+        else:
+            self.send_error(404)
+            return
+
+        if kind == 'qc':
+            content_type = JSON
+            params = {'limit': params['limit']}
+        else:
+            content_type = self.get_content_type()
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = self.server.payloads.get(kind, content_type, compress, **params)
+        self.send(body, content_type, compress)
+
+    def do_POST(self):
+        if self.path != '/api/qc/upload/':
+            self.send_error(404)
+            return
+
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        data = json.loads(body)
+        rows = sum(len(x['data']) for x in data)
+        self.send(json.dumps({'rows': rows}).encode())
+
+
+def start(host='127.0.0.1', port=0, size=SIZE):
+    """
+    Starts the server in a background thread, with datasets of the given
+    number of rows, returns the server and its URL.
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.payloads = Payloads(size)
+    server.bytes_sent = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://{host}:{server.server_port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the WSN server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--size', type=int, default=SIZE, help='Rows of every dataset')
+    args = parser.parse_args()
+
+    server, url = start(args.host, args.port, args.size)
+    print(f'Serving on {url}')
+    threading.Event().wait()
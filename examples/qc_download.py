@@ -2,9 +2,9 @@
 import datetime
 import os
 
-# Requirements
-import pandas as pd
-import requests
+# This package
+from wsn_client.client import WSNClient
+from wsn_client.qc import qc_download
 
 
 HOST = os.getenv('API_HOST', 'https://wsn.latice.eu')
@@ -16,21 +16,11 @@ if __name__ == '__main__':
     since = datetime.datetime(2020, 1, 1)
     until = datetime.datetime(2021, 1, 1)
 
-    # Variables
-    headers = {'Authorization': f'Api-Key {KEY}'}
-    url = f'{HOST}/api/qc/download/{name}/'
-
-    # Filter by time range (optional)
-    since = int(since.timestamp())
-    until = int(until.timestamp())
-    url = f'{url}?time__gte={since}&time__lt={until}'
-
-    # Download the data
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-
-    # Create dataframe from the data
-    data = response.json()
-    df = pd.DataFrame.from_dict(data)
+    # Download the data, in chunks of 30 days, 4 at a time, and keep it in a
+    # local cache so running again does not download it again
+    client = WSNClient(host=HOST, api_key=KEY)
+    df = qc_download(name, since, until, client=client,
+                     chunk=datetime.timedelta(days=30), workers=4,
+                     cache='~/.cache/wsn_client')
     print(df)
     print()
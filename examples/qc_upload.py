@@ -1,13 +1,15 @@
 # Standard Library
 import copy
 import datetime
-import json
 import os
 import pprint
 
 # Requirements
 import pandas as pd
-import requests
+
+# This package
+from wsn_client.client import WSNClient
+from wsn_client.qc import qc_upload
 
 
 HOST = os.getenv('API_HOST', 'https://wsn.latice.eu')
@@ -56,18 +58,9 @@ if __name__ == '__main__':
     print('\nTHIS IS THE DATAFRAME:')
     print(df)
 
-    # Output the dataframe as JSON records
-    data = df.to_dict(orient='records')
-    data = [{
-        'name': NAME,
-        'data': data,
-    }]
-    print('\nTHIS IS THE DATA THAT WILL BE SENT:')
-    pprint.pprint(data)
-
-    # Upload the data
-    headers = {'Authorization': f'Api-Key {KEY}'}
-    response = requests.post(f'{HOST}/api/qc/upload/', json=data, headers=headers)
-    response.raise_for_status()
+    # Upload the data, in batches of 10000 rows, compressed, 4 at a time.
+    # If interrupted, running again resumes from the checkpoint.
+    client = WSNClient(host=HOST, api_key=KEY)
+    responses = qc_upload(NAME, df, client=client, checkpoint=f'{NAME}.upload.json')
     print('\nTHIS IS THE RESPONSE FROM THE SERVER:')
-    pprint.pprint(response.json())
+    pprint.pprint(responses)
@@ -20,6 +20,16 @@ VERSION = None
 # What packages are required for this module to be executed?
 REQUIRED = ['pandas>=1.0', 'requests']
 
+# What packages are optional?
+EXTRAS = {
+    'async': ['aiohttp'],
+    'arrow': ['pyarrow'],
+    'polars': ['polars'],
+    'msgpack': ['msgpack'],
+    'compression': ['brotli', 'zstandard'],
+    'dask': ['dask[dataframe]'],
+}
+
 
 # The rest you shouldn't have to touch too much :)
 # ------------------------------------------------
@@ -95,11 +105,14 @@ setup(
     url=URL,
     packages=find_packages(),
 
-    # entry_points={
-    #     'console_scripts': ['mycli=mymodule:cli'],
-    # },
+    entry_points={
+        'console_scripts': [
+            'wsn-query=wsn_client.export:main',
+            'wsn-sync=wsn_client.mirror:main',
+        ],
+    },
     install_requires=REQUIRED,
-    #extras_require=EXTRAS,
+    extras_require=EXTRAS,
     include_package_data=True,
     license='MIT',
     classifiers=[
@@ -0,0 +1,168 @@
+"""
+Tests of the wire formats (JSON, MessagePack and Arrow, with and without
+gzip) against the local stand-in server of the benchmarks.
+"""
+
+import json
+
+import pytest
+
+from benchmarks import payloads, server
+from wsn_client.client import CONTENT_TYPES, WSNClient, decode, get_accept
+from wsn_client.query import to_json
+
+
+FORMATS = ['json', 'msgpack', 'arrow']
+MODULES = {'json': 'json', 'msgpack': 'msgpack', 'arrow': 'pyarrow'}
+
+
+@pytest.fixture(scope='module')
+def httpd():
+    httpd, url = server.start(size=1000)
+    httpd.url = url
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture(scope='module')
+def url(httpd):
+    return httpd.url
+
+
+def get_client(url, format, compress):
+    pytest.importorskip(MODULES[format])
+    client = WSNClient(host=url, token='test', formats=[format])
+    if not compress:
+        client.session.headers['Accept-Encoding'] = 'identity'
+    return client
+
+
+def encode(format, data):
+    if format == 'arrow':
+        import pyarrow as pa
+
+        table = payloads.to_arrow_table(data)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    if format == 'msgpack':
+        import msgpack
+        return msgpack.packb(data)
+
+    return json.dumps(data).encode()
+
+
+def get_rows(data):
+    """
+    Returns the rows as dicts without the missing values, to compare the
+    dense and sparse formats.
+    """
+    data = to_json(data)
+    if data['format'] == 'sparse':
+        rows = data['rows']
+    else:
+        rows = [dict(zip(data['columns'], row)) for row in data['rows']]
+
+    return [{k: v for k, v in row.items() if v is not None} for row in rows]
+
+
+def test_get_accept():
+    assert get_accept(['json']) == 'application/json'
+
+    pytest.importorskip('pyarrow')
+    pytest.importorskip('msgpack')
+    assert get_accept() == (
+        'application/vnd.apache.arrow.stream, application/msgpack;q=0.7, '
+        'application/json;q=0.3'
+    )
+    assert get_accept(['msgpack']) == 'application/msgpack, application/json;q=0.5'
+
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('kind', ['dense', 'sparse'])
+def test_decode(format, kind):
+    pytest.importorskip(MODULES[format])
+    data = payloads.generate(20, kind)
+    content_type = CONTENT_TYPES[format][0]
+
+    decoded = decode(content_type, encode(format, data))
+    assert get_rows(decoded) == get_rows(data)
+
+    # Parameters of the content type are ignored
+    decoded = decode(f'{content_type}; charset=utf-8', encode(format, data))
+    assert get_rows(decoded) == get_rows(data)
+
+
+def test_decode_fallback():
+    data = payloads.generate(5)
+    assert decode(None, json.dumps(data).encode()) == data
+    assert decode('text/plain', json.dumps(data).encode()) == data
+
+    msgpack = pytest.importorskip('msgpack')
+    assert decode('application/x-msgpack', msgpack.packb(data)) == data
+
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('compress', [True, False])
+def test_get(httpd, url, format, compress):
+    client = get_client(url, format, compress)
+    response, data = client.get(client.url('/api/query/clickhouse/'), {'limit': 50})
+
+    content_type = CONTENT_TYPES[format][0]
+    assert response.request.headers['Accept'].startswith(content_type)
+    assert response.headers['Content-Type'] == content_type
+    if compress:
+        assert 'gzip' in response.request.headers['Accept-Encoding']
+        assert response.headers['Content-Encoding'] == 'gzip'
+    else:
+        assert response.request.headers['Accept-Encoding'] == 'identity'
+        assert 'Content-Encoding' not in response.headers
+
+    assert get_rows(data) == get_rows(httpd.payloads.select('dense', limit=50))
+
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('compress', [True, False])
+@pytest.mark.parametrize('db', ['clickhouse', 'postgresql'])
+def test_query(httpd, url, format, compress, db):
+    client = get_client(url, format, compress)
+    kind = 'dense' if db == 'clickhouse' else 'sparse'
+    expected = get_rows(httpd.payloads.select(kind, limit=50))
+
+    data = client.query(db, table='finseflux_Biomet', limit=50, format='json')
+    assert get_rows(data) == expected
+
+    pd = pytest.importorskip('pandas')
+    df = client.query(db, table='finseflux_Biomet', limit=50, time_index=False)
+    assert isinstance(df, pd.DataFrame)
+    assert len(df) == 50
+    assert set(df.columns) == set().union(*expected)
+
+
+@pytest.mark.parametrize('db', ['clickhouse', 'postgresql'])
+def test_time_range(httpd, url, db):
+    import datetime
+
+    client = WSNClient(host=url, token='test', formats=['json'])
+    kind = 'dense' if db == 'clickhouse' else 'sparse'
+    start = payloads.START + 100 * payloads.STEP
+    end = payloads.START + 599 * payloads.STEP
+    params = dict(
+        table='finseflux_Biomet', limit=None, format='json',
+        time__gte=datetime.datetime.fromtimestamp(start, datetime.timezone.utc),
+        time__lte=datetime.datetime.fromtimestamp(end, datetime.timezone.utc),
+    )
+    expected = get_rows(httpd.payloads.select(kind, start, end))
+    assert len(expected) == 500
+
+    assert get_rows(client.query(db, **params)) == expected
+    assert get_rows(client.query(db, chunk=60 * payloads.STEP, **params)) == expected
+    pages = list(client.iter_query(db, page_size=120, **params))
+    assert len(pages) == 5
+    assert [row for page in pages for row in get_rows(page)] == expected
+
+    fields = ['RECORD', 'SWIN_6_10_1_1_1']
+    rows = get_rows(client.query(db, fields=fields, **params))
+    assert {key for row in rows for key in row} <= {'time', *fields}
@@ -0,0 +1,365 @@
+"""
+Asyncio version of query(), backed by aiohttp (pip install aiohttp).
+
+    import asyncio
+    from wsn_client import aio
+
+    async def main():
+        frames = await asyncio.gather(*[
+            aio.aquery('postgresql', name=name, fields=['bat'], limit=None)
+            for name in ['sw-001', 'sw-002', 'fw-001']
+        ])
+        await aio.close()
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import time
+
+from . import query as sync
+from .cache import Cache, align
+from .client import decode, get_client
+from .stats import Stats, get_rows
+
+
+# Defaults for the shared session
+LIMIT = 100             # Maximum number of open connections
+CONCURRENCY = 32        # Maximum number of requests in flight
+
+
+class AsyncSession:
+    """
+    AsyncSession(client=None, limit=100, concurrency=32, timeout=None)
+
+    Wraps an aiohttp.ClientSession, with a connection pool of the given size,
+    and a semaphore limiting the number of requests in flight. One shared
+    session is created by default per event loop, create your own to change
+    the limits. The host and token are those of the given WSNClient, or of the
+    default client:
+
+        async with AsyncSession(concurrency=100) as session:
+            await aquery(..., session=session)
+    """
+
+    def __init__(self, client=None, limit=LIMIT, concurrency=CONCURRENCY, timeout=None):
+        self.client = client
+        self.limit = limit
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = None
+
+    def open(self):
+        import aiohttp
+
+        if self.session is None:
+            client = self.client or get_client()
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                                 headers=client.headers)
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def get(self, url, params, stats=None):
+        """
+        Returns the response and the decoded data. If a Stats object is given,
+        the timings and sizes of the request are added to it (the connect time
+        is not measured, it's included in the wait).
+        """
+        self.open()
+        async with self.semaphore:
+            t0 = time.perf_counter()
+            async with self.session.get(url, params=encode_params(params)) as response:
+                t1 = time.perf_counter()
+                response.raise_for_status()
+                body = await response.read()
+                t2 = time.perf_counter()
+                data = decode(response.headers.get('Content-Type'), body)
+                t3 = time.perf_counter()
+
+        if stats is not None:
+            size = response.headers.get('Content-Length')
+            stats.add(
+                requests=1, wait=t1 - t0, download=t2 - t1, decode=t3 - t2,
+                bytes=len(body) if size is None else int(size), size=len(body),
+            )
+
+        return response, data
+
+
+sessions = {}
+
+def get_session(client=None):
+    """
+    Returns the shared session for the running event loop and the given
+    client (the default client if None).
+    """
+    loop = asyncio.get_running_loop()
+    client = client or get_client()
+    session = sessions.get((loop, client))
+    if session is None or session.session is None or session.session.closed:
+        session = sessions[(loop, client)] = AsyncSession(client).open()
+
+        # Forget the sessions of closed loops
+        for key in [key for key in sessions if key[0].is_closed()]:
+            del sessions[key]
+
+    return session
+
+
+async def close():
+    """
+    Closes the shared sessions of the running event loop, call it before the
+    loop is closed.
+    """
+    loop = asyncio.get_running_loop()
+    for key in [key for key in sessions if key[0] is loop]:
+        await sessions.pop(key).close()
+
+
+def encode_params(params):
+    """
+    aiohttp does not accept None or lists as values, do as requests does: skip
+    None and repeat the key for every item in a list.
+    """
+    items = []
+    for key, value in params.items():
+        if value is None:
+            continue
+
+        values = value if isinstance(value, (list, tuple)) else [value]
+        items.extend((key, str(x)) for x in values)
+
+    return items
+
+
+async def gather(*aws):
+    """
+    Like asyncio.gather, but if one fails (or if cancelled) the others are
+    cancelled as well.
+    """
+    tasks = [asyncio.ensure_future(x) for x in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def aquery_aggregates(db, interval_agg, format, time_index, **kw):
+    """
+    Async version of wsn_client.query.query_aggregates
+    """
+    if format != 'pandas':
+        raise ValueError('a list of aggregates requires format pandas')
+    if not kw.get('interval'):
+        raise ValueError('a list of aggregates requires interval')
+
+    aggs = list(dict.fromkeys(interval_agg))
+    results = await gather(*[
+        aquery(db, interval_agg=agg, format='pandas', time_index=False, **kw)
+        for agg in aggs
+    ])
+
+    df = sync.join_aggregates(dict(zip(aggs, results)))
+    if time_index:
+        df.set_index(sync.get_time_index(df[('time', '')].to_numpy()), inplace=True)
+
+    return df
+
+
+async def fetch(session, url, params, start, end, chunk=None, workers=4,
+                interval=None, closed=True, limit=None, stats=None, skip=None):
+    """
+    Async version of wsn_client.query.fetch
+    """
+    if chunk is None:
+        ranges = [(start, end)]
+    else:
+        ranges = sync.split_range(start, end, chunk, interval)
+
+    last = ranges[-1]
+    if skip is not None:
+        ranges = [(a, b) for a, b in ranges if not skip(a, b)] or ranges[:1]
+
+    semaphore = asyncio.Semaphore(workers)
+    async def fetch_range(start, end):
+        async with semaphore:
+            return await session.get(url, dict(params, time__gte=start, time__lte=end), stats)
+
+    results = await gather(*[fetch_range(start, end) for start, end in ranges])
+
+    # Rows at the right edge of a chunk belong to the next one
+    datas = []
+    for i, (start, end) in enumerate(ranges):
+        response, data = results[i]
+        if (start, end) != last or not closed:
+            data = sync.select(data, end=end)
+        datas.append(data)
+
+    responses = [response for response, data in results]
+    return responses, sync.merge(datas, limit)
+
+
+async def aquery(
+    db,                                     # postgresql or clickhouse
+    table=None,                             # clickhouse table name
+    fields=None,                            # Fields to return: all by default
+    tags=None,                              # postgresql metadata fields (none by default)
+    time__gte=None, time__lte=None,         # Time range (sampled)
+    received__gte=None, received__lte=None, # Time range (received)
+    limit=100,                              # Limit
+    interval=None, interval_agg=None,       # Aggregates (interval_agg may be a list)
+    format='pandas',                        # pandas, json, arrow or polars
+    time_index=True,                        # Return pandas dataframe with time as index
+                                            # (only valid if format 'pandas' is selected)
+    schema=None,                            # Schema (or name) to build the pandas dataframe
+    sparse_dtype=None,                      # Missing values of sparse data (pandas): None (NaN),
+                                            # 'masked' (nullable dtypes) or 'sparse' (SparseDtype)
+    chunk=None, workers=4,                  # Split the time range in chunks (timedelta)
+                                            # fetched concurrently
+    stream=False,                           # Not supported
+    cache=None,                             # Cache object (or path) to store the results
+    coverage=None,                          # Coverage object (or path) to skip empty chunks
+    memo=None,                              # Not supported
+    client=None,                            # WSNClient, the default one if not given
+    session=None,                           # AsyncSession, the shared one by default
+    hook=None,                              # Called with the Stats of the call
+    debug=False,
+    **kw                                    # postgresql filters (name, serial, ...)
+    ):
+    """
+    await aquery('clickhouse', table='', ...) -> dataframe or dict
+    await aquery('postgresql', ...) -> dataframe or dict
+
+    Coroutine version of wsn_client.query.query, see its documentation for the
+    parameters. The only additional parameter is session, an AsyncSession to
+    use instead of the shared one. The stream and memo parameters are not
+    supported.
+
+    Cancelling the coroutine cancels all its requests in flight.
+    """
+
+    t0 = time.perf_counter()
+
+    if stream:
+        raise NotImplementedError('aquery does not support stream')
+    if memo is not None:
+        raise NotImplementedError('aquery does not support memo')
+
+    if session is None:
+        session = get_session(client)
+
+    # Several aggregates, one query per aggregate
+    if isinstance(interval_agg, (list, tuple)):
+        return await aquery_aggregates(
+            db, interval_agg, format, time_index,
+            table=table, fields=fields, tags=tags,
+            time__gte=time__gte, time__lte=time__lte,
+            received__gte=received__gte, received__lte=received__lte,
+            limit=limit, interval=interval, schema=schema, sparse_dtype=sparse_dtype,
+            chunk=chunk, workers=workers, cache=cache, coverage=coverage,
+            client=client, session=session, hook=hook, debug=debug, **kw
+        )
+
+    client = session.client or get_client()
+    url = client.url(f'/api/query/{db}/')
+    stats = Stats(db=db, table=table or kw.get('name'))
+
+    skip = None
+    if coverage is not None:
+        if isinstance(coverage, str):
+            from .coverage import Coverage
+            coverage = Coverage(coverage)
+        skip = coverage.get_filter(db, table, **kw)
+
+    # Parameters
+    params = sync.get_params(
+        table=table, fields=fields, tags=tags,
+        time__gte=time__gte, time__lte=time__lte,
+        received__gte=received__gte, received__lte=received__lte,
+        limit=limit, interval=interval, interval_agg=interval_agg,
+        **kw
+    )
+    time__gte = params['time__gte']
+    time__lte = params['time__lte']
+
+    # Query
+    if cache is not None:
+        if time__gte is None:
+            raise ValueError('cache requires time__gte')
+        if time__lte is None:
+            time__lte = int(time.time())
+
+        if isinstance(cache, str):
+            cache = Cache(cache)
+
+        # The cache works with right-open ranges, and stores full ranges. The
+        # partial intervals at the edges are not cached
+        key = cache.get_key(url, params)
+        cached, edges = align(time__gte, time__lte + 1, interval)
+        chunk_params = dict(params, limit=None)
+        responses = []
+        parts = {}
+        for start, end in edges:
+            edge_responses, parts[start] = await fetch(session, url, chunk_params, start, end,
+                                                       closed=False, stats=stats)
+            responses.extend(edge_responses)
+
+        if cached is not None:
+            for start, end in cache.missing(key, *cached, interval):
+                chunk_responses, chunk_data = await fetch(session, url, chunk_params, start, end,
+                                                          chunk, workers, interval, closed=False,
+                                                          stats=stats, skip=skip)
+                cache.store(key, start, end, chunk_data)
+                responses.extend(chunk_responses)
+
+            parts[cached[0]] = cache.load(key, *cached)
+
+        json = sync.merge([parts[start] for start in sorted(parts)], limit)
+    elif chunk is None:
+        response, json = await session.get(url, params, stats)
+        responses = [response]
+    else:
+        if time__gte is None:
+            raise ValueError('chunk requires time__gte')
+        if time__lte is None:
+            time__lte = int(time.time())
+
+        responses, json = await fetch(session, url, params, time__gte, time__lte, chunk,
+                                      workers, interval, limit=limit, stats=stats,
+                                      skip=skip)
+
+    data = sync.convert(json, format, time_index, schema, stats, sparse_dtype)
+
+    stats.add(total=time.perf_counter() - t0, rows=get_rows(data))
+    client.metrics.record(stats)
+    if hook is not None:
+        hook(stats)
+
+    # Debug
+    if debug:
+        for response in responses:
+            print(f'{response.url}')
+        print(f'Returns {stats}')
+        print()
+        print(data)
+        print()
+
+    return data
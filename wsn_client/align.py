@@ -0,0 +1,233 @@
+"""
+Aligns the results of several queries onto a common time grid, e.g. to
+compare the stationary and the mobile CR6 stations:
+
+    frames = {
+        'perm': query('clickhouse', table='finseflux_Biomet', fields=[...], ...),
+        'mobile': query('clickhouse', table='mobileflux_Biomet', fields=[...], ...),
+    }
+    df = align(frames, freq=600, tolerance=120)
+
+The columns are renamed to their short names (see var_dict), and those in
+more than one frame get the key of their frame as suffix (lwin_perm,
+lwin_mobile).
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from .cache import to_seconds
+from .query import get_time_index
+from .resample import resample
+from .schema import SCHEMAS, Schema, get_schema
+
+
+METHODS = ['nearest', 'asof', 'interval']
+
+
+def get_times(df):
+    """
+    Returns the times of the dataframe as Unix timestamps (int64 array), from
+    the time column, or from the DatetimeIndex.
+    """
+    if 'time' in df.columns:
+        return df['time'].to_numpy().astype('int64', copy=False)
+
+    if isinstance(df.index, pd.DatetimeIndex):
+        index = df.index
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        return index.to_numpy().astype('datetime64[s]').astype('int64')
+
+    raise ValueError('the dataframe has no time column nor DatetimeIndex')
+
+
+def find_schema(columns):
+    """
+    Returns the schema whose names match most of the columns, None if none
+    matches.
+    """
+    best, matches = None, 0
+    for name, (names, dtypes) in SCHEMAS.items():
+        n = len(set(columns) & set(names))
+        if n > matches:
+            best, matches = name, n
+
+    return None if best is None else get_schema(best)
+
+
+def get_names(frames, schemas=None, short_names=True):
+    """
+    Returns, for every frame, the list of the new names of its columns: the
+    short names, with the key of the frame as suffix if in several frames.
+    """
+    schemas = schemas or {}
+    names = {}
+    for key, columns in frames.items():
+        schema = schemas.get(key, 'auto') if short_names else None
+        if schema == 'auto':
+            schema = find_schema(columns)
+        elif isinstance(schema, str):
+            schema = get_schema(schema)
+
+        names[key] = schema.rename(columns) if isinstance(schema, Schema) else list(columns)
+
+    count = {}
+    for key in names:
+        for name in set(names[key]):
+            count[name] = count.get(name, 0) + 1
+
+    return {
+        key: [f'{name}_{key}' if count[name] > 1 else name for name in names[key]]
+        for key in names
+    }
+
+
+def nearest(times, grid, tolerance):
+    """
+    Returns the positions of the times nearest to the grid times, and whether
+    they are within the tolerance.
+    """
+    n = len(times)
+    if n == 0:
+        return np.zeros(len(grid), dtype='int64'), np.zeros(len(grid), dtype=bool)
+
+    right = np.minimum(np.searchsorted(times, grid, side='left'), n - 1)
+    left = np.maximum(right - 1, 0)
+    dleft = np.abs(grid - times[left])
+    dright = np.abs(times[right] - grid)
+    index = np.where(dleft <= dright, left, right)
+    return index, np.minimum(dleft, dright) <= tolerance
+
+
+def asof(times, grid, tolerance):
+    """
+    Returns the positions of the last times at or before the grid times, and
+    whether they are within the tolerance.
+    """
+    index = np.searchsorted(times, grid, side='right') - 1
+    valid = index >= 0
+    index = np.maximum(index, 0)
+    if len(times):
+        valid &= grid - times[index] <= tolerance
+    return index, valid
+
+
+def take(df, index, valid):
+    """
+    Returns the rows at the given positions, with missing values (NaN) where
+    not valid.
+    """
+    if len(df) == 0:
+        return df.reindex(range(len(index))).reset_index(drop=True)
+
+    df = df.iloc[index].reset_index(drop=True)
+    if not valid.all():
+        df = df.where(np.broadcast_to(valid[:, None], df.shape))
+
+    return df
+
+
+def align(
+    frames,                                 # Dict (or list) of dataframes
+    freq,                                   # Grid step (seconds or timedelta)
+    tolerance=None,                         # Maximum distance to the grid (seconds or timedelta)
+    method='nearest',                       # nearest, asof or interval
+    agg='avg',                              # Aggregate for method='interval'
+    start=None, end=None,                   # Grid range (Unix timestamps or datetime)
+    schemas=None,                           # Schema (or name) per frame, guessed by default
+    short_names=True,                       # Rename the columns to their short names
+    time_index=True,                        # Return the time as index
+    ):
+    """
+    align(frames, freq, ...) -> dataframe
+
+    Puts several query() results onto a shared time grid, one row per grid
+    time. The frames are given as a dictionary (the keys identify the frames)
+    or as a list (the keys are the positions). Every frame has the time
+    column (Unix timestamps), as returned by query(), or a DatetimeIndex.
+
+    The grid has a step of freq seconds, aligned to multiples of freq since
+    the Unix epoch, from start to end (both included), by default from the
+    first to the last time of the frames. The methods are:
+
+    - 'nearest' the row nearest to the grid time, within the tolerance
+      (default freq/2)
+    - 'asof' the last row at or before the grid time, within the tolerance
+      (default freq)
+    - 'interval' the aggregate (avg, count, max, min, stddev, sum or variance)
+      of the rows in the interval [time, time + freq), see resample
+
+    Grid times without a row are missing values (NaN). All is vectorized, with
+    binary searches (np.searchsorted) over the times of every frame.
+
+    The columns are renamed to their short names, from the schemas (see
+    wsn_client.schema); by default the schema is guessed from the column names.
+    Columns with the same name in several frames get the key of their frame
+    as suffix, e.g. lwin_perm and lwin_mobile.
+
+    The result has the time column (the grid), and the time as index unless
+    time_index is False.
+    """
+    if method not in METHODS:
+        raise ValueError(f'unexpected method {method!r}, choices are {METHODS}')
+
+    if not isinstance(frames, dict):
+        frames = dict(enumerate(frames))
+
+    freq = to_seconds(freq)
+    if freq <= 0:
+        raise ValueError('freq must be positive')
+
+    if tolerance is None:
+        tolerance = freq // 2 if method == 'nearest' else freq
+    tolerance = to_seconds(tolerance)
+
+    # Times and data of every frame, sorted by time
+    datas = {}
+    for key, df in frames.items():
+        times = get_times(df)
+        data = df.drop(columns='time', errors='ignore').reset_index(drop=True)
+        if len(times) > 1 and (np.diff(times) < 0).any():
+            order = np.argsort(times, kind='stable')
+            times = times[order]
+            data = data.iloc[order].reset_index(drop=True)
+        datas[key] = (times, data)
+
+    # The grid
+    if isinstance(start, datetime.datetime):
+        start = start.timestamp()
+    if isinstance(end, datetime.datetime):
+        end = end.timestamp()
+    firsts = [times[0] for times, data in datas.values() if len(times)]
+    lasts = [times[-1] for times, data in datas.values() if len(times)]
+    start = min(firsts, default=0) if start is None else int(start)
+    end = max(lasts, default=-1) if end is None else int(end)
+    grid = np.arange(start // freq * freq, end + 1, freq, dtype='int64')
+
+    # Align every frame
+    aligned = {}
+    for key, (times, data) in datas.items():
+        if method == 'interval':
+            df = resample(data.assign(time=times), freq, agg, time_index=False)
+            df = df.set_index('time').reindex(grid).reset_index(drop=True)
+        else:
+            function = asof if method == 'asof' else nearest
+            index, valid = function(times, grid, tolerance)
+            df = take(data, index, valid)
+
+        aligned[key] = df
+
+    # Rename, and concatenate
+    names = get_names({key: list(df.columns) for key, df in aligned.items()}, schemas,
+                      short_names)
+    for key, df in aligned.items():
+        df.columns = names[key]
+
+    df = pd.concat([pd.DataFrame({'time': grid})] + list(aligned.values()), axis=1)
+    if time_index:
+        df.set_index(get_time_index(grid), inplace=True)
+
+    return df
@@ -0,0 +1,362 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import copy
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def to_seconds(x):
+    if isinstance(x, datetime.timedelta):
+        return int(x.total_seconds())
+    return x
+
+
+class Cache:
+    """
+    Cache(path, ttl=timedelta(hours=1), recent=timedelta(days=1))
+
+    Persistent cache for the results of query(). Every query (database, table,
+    fields, tags, filters and interval) has its own directory, with an index
+    file listing the time ranges already fetched, and one gzipped JSON file
+    per time range with the data as was sent by the server.
+
+    The time ranges are right-open [start, end), as Unix timestamps.
+
+    A time range that ends within `recent` seconds of the time it was fetched
+    is considered incomplete, because more data may arrive later (e.g. frames
+    uploaded from the SD card), and it will expire after `ttl` seconds. Older
+    time ranges never expire.
+    """
+
+    def __init__(self, path='~/.cache/wsn_client', ttl=datetime.timedelta(hours=1),
+                 recent=datetime.timedelta(days=1)):
+        self.path = os.path.expanduser(path)
+        self.ttl = to_seconds(ttl)
+        self.recent = to_seconds(recent)
+        self.lock = threading.Lock()
+
+    def get_key(self, *args):
+        """
+        Returns the key for the given query, the time range and the limit are
+        not part of the key.
+        """
+        args = list(args)
+        for i, arg in enumerate(args):
+            if isinstance(arg, dict):
+                exclude = {'time__gte', 'time__lte', 'limit'}
+                args[i] = {k: v for k, v in arg.items() if k not in exclude}
+
+        key = json.dumps(args, sort_keys=True, default=str)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    #
+    # Index
+    #
+    def get_dir(self, key):
+        return os.path.join(self.path, key)
+
+    def read_index(self, key):
+        path = os.path.join(self.get_dir(key), 'index.json')
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def write_index(self, key, segments):
+        path = os.path.join(self.get_dir(key), 'index.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(segments, f)
+        os.replace(tmp, path)
+
+    def is_valid(self, segment, now):
+        fetched = segment['fetched']
+        if segment['end'] <= fetched - self.recent:
+            return True
+
+        return now < fetched + self.ttl
+
+    def get_segments(self, key, now=None):
+        """
+        Returns the valid segments, newest first.
+        """
+        if now is None:
+            now = time.time()
+
+        segments = self.read_index(key)
+        segments = [x for x in segments if self.is_valid(x, now)]
+        segments.sort(key=lambda x: x['fetched'], reverse=True)
+        return segments
+
+    #
+    # Public API
+    #
+    def missing(self, key, start, end, interval=None):
+        """
+        Returns the list of time ranges within [start, end) not in the cache.
+
+        If an interval is given the ranges are extended to the interval
+        edges, so every interval is computed by the server in full.
+        """
+        with self.lock:
+            segments = self.get_segments(key)
+
+        ranges = subtract([(start, end)], [(x['start'], x['end']) for x in segments])
+        if interval:
+            ranges = [
+                (start // interval * interval, -(-end // interval) * interval)
+                for start, end in ranges
+            ]
+
+        return ranges
+
+    def store(self, key, start, end, data):
+        """
+        Stores the data for the time range [start, end). Older segments fully
+        covered by the newer ones, and expired segments, are removed.
+        """
+        from .query import to_json
+
+        now = time.time()
+        dirpath = self.get_dir(key)
+        os.makedirs(dirpath, exist_ok=True)
+
+        filename = f'{start}-{end}-{time.time_ns()}.json.gz'
+        with gzip.open(os.path.join(dirpath, filename), 'wt') as f:
+            json.dump(to_json(data), f)
+
+        segment = {'start': start, 'end': end, 'fetched': now, 'file': filename}
+        with self.lock:
+            old = self.read_index(key)
+            valid = self.get_segments(key, now)
+            segments = [segment]
+            for x in valid:
+                newer = [(y['start'], y['end']) for y in segments]
+                if subtract([(x['start'], x['end'])], newer):
+                    segments.append(x)
+
+            self.write_index(key, segments)
+
+            # Remove the data files no longer referenced
+            keep = {x['file'] for x in segments}
+            for x in old:
+                if x['file'] not in keep:
+                    try:
+                        os.remove(os.path.join(dirpath, x['file']))
+                    except FileNotFoundError:
+                        pass
+
+    def load(self, key, start, end, limit=None):
+        """
+        Returns the data for the time range [start, end). When segments
+        overlap the data from the newest one is used.
+        """
+        from .query import merge, select
+
+        with self.lock:
+            segments = self.get_segments(key)
+
+        parts = []
+        newer = []
+        for segment in segments:
+            ranges = [(max(segment['start'], start), min(segment['end'], end))]
+            ranges = [(a, b) for a, b in ranges if a < b]
+            ranges = subtract(ranges, newer)
+            newer.append((segment['start'], segment['end']))
+            if not ranges:
+                continue
+
+            path = os.path.join(self.get_dir(key), segment['file'])
+            with gzip.open(path, 'rt') as f:
+                data = json.load(f)
+
+            for a, b in ranges:
+                parts.append((a, select(data, a, b)))
+
+        parts.sort(key=lambda x: x[0])
+        return merge([data for a, data in parts], limit)
+
+    def clear(self, key=None):
+        """
+        Removes the given query from the cache, or everything if no key is
+        given.
+        """
+        import shutil
+
+        path = self.path if key is None else self.get_dir(key)
+        with self.lock:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class MemoryCache:
+    """
+    MemoryCache(maxsize=256 * 2**20, ttl=timedelta(minutes=5))
+
+    In-memory LRU cache for the results of query(), for processes that run
+    the same queries again and again (e.g. a dashboard server). Unlike Cache,
+    the whole result is cached, for the exact same query (time range and
+    limit included).
+
+    The cache is bounded by the estimated size of the results (maxsize
+    bytes), the least recently used are evicted first, and the results
+    expire after ttl.
+
+    Concurrent identical queries are coalesced: while a query is in flight,
+    the other threads asking for the same wait for its result, instead of
+    sending the same request. Errors are not cached.
+
+    Every caller gets its own copy of the result, so modifying it does not
+    affect the others: pandas dataframes are copied (with copy-on-write, in
+    pandas 3 or if enabled, the copy is cheap), pyarrow tables are immutable,
+    polars dataframes are cloned (cheap), and dicts are deep-copied.
+    """
+
+    def __init__(self, maxsize=256 * 2**20, ttl=datetime.timedelta(minutes=5)):
+        self.maxsize = maxsize
+        self.ttl = to_seconds(ttl)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()     # key -> (expires, size, data)
+        self.inflight = {}               # key -> Future
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, *args):
+        key = json.dumps(args, sort_keys=True, default=str)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key, function):
+        """
+        Returns a copy of the cached result for the key, if not cached calls
+        the function to get it (once, even if called concurrently).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, size, data = entry
+                if time.monotonic() < expires:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return copy_result(data)
+                self.remove(key)
+
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not owner:
+            return copy_result(future.result())
+
+        try:
+            data = function()
+        except BaseException as exc:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(exc)
+            raise
+
+        size = get_size(data)
+        with self.lock:
+            del self.inflight[key]
+            if size <= self.maxsize:
+                self.entries[key] = (time.monotonic() + self.ttl, size, data)
+                self.size += size
+                while self.size > self.maxsize:
+                    self.remove(next(iter(self.entries)))
+
+        future.set_result(data)
+        return copy_result(data)
+
+    def remove(self, key):
+        expires, size, data = self.entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+def get_size(data):
+    """
+    Returns the estimated size of the result in memory, in bytes.
+    """
+    if isinstance(data, dict):
+        return len(json.dumps(data, default=str))
+
+    module = type(data).__module__.split('.')[0]
+    if module == 'pandas':
+        return int(data.memory_usage(index=True, deep=True).sum())
+    if module == 'pyarrow':
+        return data.nbytes
+    if module == 'polars':
+        return data.estimated_size()
+
+    return 0
+
+
+def copy_result(data):
+    """
+    Returns a copy of the result, which the caller can modify safely.
+    """
+    if isinstance(data, dict):
+        return copy.deepcopy(data)
+
+    module = type(data).__module__.split('.')[0]
+    if module == 'pandas':
+        import pandas as pd
+        cow = int(pd.__version__.split('.')[0]) >= 3 or pd.options.mode.copy_on_write is True
+        return data.copy(deep=not cow)
+    if module == 'polars':
+        return data.clone()
+
+    return data
+
+
+def align(start, end, interval=None):
+    """
+    Splits the right-open range [start, end) in the part made of whole
+    intervals, to be cached, and the partial intervals at the edges, to be
+    fetched directly: the server computes them with the rows within the range
+    only, so they depend on the range. Returns the cached range (None if
+    empty) and the list of edges.
+    """
+    if not interval:
+        return (start, end), []
+
+    a = -(-start // interval) * interval
+    b = end // interval * interval
+    if a >= b:
+        return None, [(start, end)]
+
+    edges = [(x, y) for x, y in [(start, a), (b, end)] if x < y]
+    return (a, b), edges
+
+
+def subtract(ranges, others):
+    """
+    Returns the parts of the right-open ranges not covered by the others.
+    """
+    for a, b in others:
+        new = []
+        for start, end in ranges:
+            if b <= start or end <= a:
+                new.append((start, end))
+                continue
+            if start < a:
+                new.append((start, a))
+            if b < end:
+                new.append((b, end))
+        ranges = new
+
+    return ranges
@@ -0,0 +1,336 @@
+import importlib.util
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+from .stats import Metrics
+
+
+# Content types, by order of preference, and the module required to decode
+CONTENT_TYPES = {
+    'arrow': ('application/vnd.apache.arrow.stream', 'pyarrow'),
+    'msgpack': ('application/msgpack', 'msgpack'),
+    'json': ('application/json', 'json'),
+}
+
+
+def get_accept(formats=None):
+    """
+    Returns the value of the Accept header for the given formats, those that
+    cannot be decoded (the module is not installed) are skipped. JSON is
+    always accepted, as a fallback.
+    """
+    if formats is None:
+        formats = list(CONTENT_TYPES)
+
+    accept = []
+    for name in formats:
+        content_type, module = CONTENT_TYPES[name]
+        if importlib.util.find_spec(module) is not None:
+            accept.append(content_type)
+
+    if 'json' not in formats:
+        accept.append(CONTENT_TYPES['json'][0])
+
+    n = len(accept)
+    return ', '.join(
+        f'{x};q={(n - i) / n:.1f}' if i else x
+        for i, x in enumerate(accept)
+    )
+
+
+def decode(content_type, body):
+    """
+    Decodes the body of the response, according to its content type. Data in
+    the Arrow IPC format is returned as {'format': 'arrow', 'table': table}.
+    """
+    content_type = (content_type or '').split(';')[0].strip()
+
+    if content_type == CONTENT_TYPES['arrow'][0]:
+        import pyarrow as pa
+        table = pa.ipc.open_stream(body).read_all()
+        return {'format': 'arrow', 'table': table}
+
+    if content_type in (CONTENT_TYPES['msgpack'][0], 'application/x-msgpack'):
+        import msgpack
+        return msgpack.unpackb(body, raw=False)
+
+    return json.loads(body)
+
+
+def is_json(content_type):
+    content_type = (content_type or '').split(';')[0].strip()
+    return content_type not in (
+        CONTENT_TYPES['arrow'][0], CONTENT_TYPES['msgpack'][0], 'application/x-msgpack',
+    )
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """
+    Records the time to connect (DNS resolution, TCP and TLS), it's reset once
+    read, so it's only reported by the first request of the connection.
+    """
+
+    connect_time = 0
+
+    def connect(self):
+        t0 = time.perf_counter()
+        super().connect()
+        self.connect_time = time.perf_counter() - t0
+
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kw):
+        super().init_poolmanager(*args, **kw)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def pop_connect_time(response):
+    connection = getattr(response.raw, 'connection', None)
+    connect_time = getattr(connection, 'connect_time', 0)
+    if connect_time:
+        connection.connect_time = 0
+    return connect_time
+
+
+class WSNClient:
+    """
+    WSNClient(host=None, token=None, api_key=None, pool_maxsize=32, retries=3, backoff=0.5,
+              timeout=None, formats=None)
+
+    Client to the UiO Django system. The host and token default to the
+    WSN_HOST and WSN_TOKEN environment variables, e.g.
+
+        export WSN_HOST="http://localhost:8000"
+        export WSN_TOKEN="...."
+
+    The quality controlled data API (/api/qc/) is authenticated with an API
+    key instead, which defaults to the API_KEY environment variable. For this
+    API the host may be as well defined with the API_HOST environment
+    variable.
+
+    Nothing is done until the first request, then the HTTP session is created,
+    with a keep-alive connection pool of pool_maxsize connections (use at least
+    as many as the workers when fetching concurrently), and retries with
+    exponential backoff on connection errors and 429/5xx responses.
+
+    The timeout (seconds, or a (connect, read) tuple) applies to every
+    request, by default there is none.
+
+    The responses are requested compressed (gzip, deflate, and brotli or zstd
+    if the brotli or zstandard packages are installed). The formats parameter
+    lists the wire formats to request, by order of preference, among 'arrow'
+    (Arrow IPC stream, requires pyarrow), 'msgpack' (requires msgpack) and
+    'json'. By default all installed are requested. Whatever the server
+    returns is decoded, with JSON as the fallback.
+
+    The statistics of every query are aggregated in the metrics attribute, see
+    wsn_client.stats.Metrics.
+
+    Example:
+
+        client = WSNClient(pool_maxsize=64)
+        df = client.query('clickhouse', table='finseflux_Biomet', ...)
+    """
+
+    def __init__(self, host=None, token=None, api_key=None, pool_maxsize=32, retries=3,
+                 backoff=0.5, timeout=None, formats=None):
+        self.host = host
+        self.token = token
+        self.api_key = api_key
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.formats = formats
+        self.metrics = Metrics()
+        self._session = None
+        self._lock = threading.Lock()
+
+    def configure(self):
+        if self.host is None:
+            self.host = os.getenv('WSN_HOST') or os.getenv('API_HOST')
+            if self.host is None:
+                raise RuntimeError('define the WSN_HOST environment variable')
+
+        if self.token is None:
+            self.token = os.getenv('WSN_TOKEN')
+
+        if self.api_key is None:
+            self.api_key = os.getenv('API_KEY')
+
+    def get_auth(self, auth='token'):
+        """
+        Returns the Authorization header, with the token (auth='token') or with
+        the API key (auth='api_key').
+        """
+        self.configure()
+        if auth == 'api_key':
+            if self.api_key is None:
+                raise RuntimeError('define the API_KEY environment variable')
+            return {'Authorization': f'Api-Key {self.api_key}'}
+
+        if self.token is None:
+            raise RuntimeError('define the WSN_TOKEN environment variable')
+        return {'Authorization': f'Token {self.token}'}
+
+    @property
+    def headers(self):
+        return dict(self.get_auth(), Accept=get_accept(self.formats))
+
+    def setup(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = TimedHTTPAdapter(pool_maxsize=self.pool_maxsize, max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept'] = get_accept(self.formats)
+        session.headers['Accept-Encoding'] = make_headers(accept_encoding=True)['accept-encoding']
+        return session
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.setup()
+
+        return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __getstate__(self):
+        # Picklable (e.g. to send it to Dask workers), without the session
+        state = self.__dict__.copy()
+        del state['_session'], state['_lock'], state['metrics']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.metrics = Metrics()
+        self._session = None
+        self._lock = threading.Lock()
+
+    def url(self, path):
+        self.configure()
+        return f'{self.host}{path}'
+
+    def get(self, url, params=None, auth='token', stats=None, stream=False):
+        """
+        Returns the response and the decoded data. If a Stats object is given,
+        the timings and sizes of the request are added to it.
+
+        With stream=True JSON responses are decoded while downloaded, see
+        wsn_client.stream, with stream='process' by a worker process. Then the
+        download time includes most of the decoding.
+        """
+        headers = self.get_auth(auth)
+        t0 = time.perf_counter()
+        response = self.session.get(url, params=params, headers=headers, timeout=self.timeout,
+                                    stream=True)
+        t1 = time.perf_counter()
+        connect = pop_connect_time(response)
+        content_type = response.headers.get('Content-Type')
+        if stream and response.ok and is_json(content_type):
+            from .stream import decode_response
+
+            data, size = decode_response(response, process=stream == 'process')
+            t2 = t3 = time.perf_counter()
+        else:
+            body = response.content
+            t2 = time.perf_counter()
+            response.raise_for_status()
+            data = decode(content_type, body)
+            t3 = time.perf_counter()
+            size = len(body)
+
+        if stats is not None:
+            stats.add(
+                requests=1, connect=connect, wait=t1 - t0 - connect,
+                download=t2 - t1, decode=t3 - t2,
+                bytes=response.raw.tell(), size=size,
+            )
+
+        return response, data
+
+    def post(self, url, data, headers=None, auth='api_key'):
+        """
+        Posts the data (bytes), returns the response and the decoded data.
+        Note that POST requests are not retried.
+        """
+        headers = dict(headers or {}, **self.get_auth(auth))
+        response = self.session.post(url, data=data, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response, decode(response.headers.get('Content-Type'), response.content)
+
+    def query(self, *args, **kw):
+        """
+        See wsn_client.query.query
+        """
+        from .query import query
+        return query(*args, client=self, **kw)
+
+    def iter_query(self, *args, **kw):
+        """
+        See wsn_client.query.iter_query
+        """
+        from .query import iter_query
+        return iter_query(*args, client=self, **kw)
+
+    def query_many(self, *args, **kw):
+        """
+        See wsn_client.query.query_many
+        """
+        from .query import query_many
+        return query_many(*args, client=self, **kw)
+
+
+default_client = None
+default_lock = threading.Lock()
+
+def get_client():
+    """
+    Returns the default client, used when no client is given.
+    """
+    global default_client
+
+    if default_client is None:
+        with default_lock:
+            if default_client is None:
+                default_client = WSNClient()
+
+    return default_client
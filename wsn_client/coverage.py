@@ -0,0 +1,250 @@
+"""
+Coverage index: the number of rows per day of every source, kept on disk, to
+know in advance which time ranges have data.
+
+    coverage = Coverage('~/.cache/wsn_client/coverage')
+    coverage.update('postgresql', name='sw-001', time__gte=datetime.datetime(2018, 1, 1))
+    coverage.ranges('postgresql', name='sw-001')
+
+And pass it to query() to skip the chunks without data:
+
+    query('postgresql', name='sw-001', ..., chunk=datetime.timedelta(days=7),
+          coverage=coverage)
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .cache import subtract, to_seconds
+from .query import query, to_json, to_timestamp
+
+
+DAY = 86400
+
+
+def from_timestamp(x):
+    return datetime.datetime.fromtimestamp(x, datetime.timezone.utc)
+
+
+def union(ranges):
+    """
+    Returns the right-open ranges sorted, with the overlapping or contiguous
+    ranges merged.
+    """
+    merged = []
+    for start, end in sorted(tuple(x) for x in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return [tuple(x) for x in merged]
+
+
+def clip(ranges, end):
+    """
+    Returns the ranges cut at the given end, the empty ranges are dropped.
+    """
+    ranges = [(a, min(b, end)) for a, b in ranges]
+    return [(a, b) for a, b in ranges if a < b]
+
+
+class Coverage:
+    """
+    Coverage(path='~/.cache/wsn_client/coverage', recent=timedelta(days=2))
+
+    Keeps, for every source (database, table and filters), a JSON file with
+    the number of rows per day (UTC), and the time ranges already counted. The
+    days without rows are not stored.
+
+    The counts are built with aggregate queries, one row per day, which are
+    cheap for the server: query(..., interval=86400, interval_agg='count').
+    Calling update again only counts the days not counted yet, and the last
+    days (see the recent parameter), because more data may arrive later. The
+    last days are not kept as counted, so they're never skipped by query().
+    """
+
+    def __init__(self, path='~/.cache/wsn_client/coverage', recent=datetime.timedelta(days=2)):
+        self.path = os.path.expanduser(path)
+        self.recent = to_seconds(recent)
+        self.lock = threading.Lock()
+
+    def get_key(self, db, table=None, **kw):
+        source = {'db': db, 'table': table, **{k: v for k, v in kw.items() if v is not None}}
+        key = json.dumps(source, sort_keys=True, default=str)
+        return hashlib.sha1(key.encode()).hexdigest(), source
+
+    def read(self, key):
+        path = os.path.join(self.path, f'{key}.json')
+        try:
+            with open(path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {'days': {}, 'ranges': []}
+
+        index['days'] = {int(day): count for day, count in index['days'].items()}
+        return index
+
+    def write(self, key, index):
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, f'{key}.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+
+    def update(self, db, table=None, time__gte=None, time__lte=None, fields=None,
+               client=None, debug=False, **kw):
+        """
+        Counts the rows per day within the time range [time__gte, time__lte]
+        (datetime objects), extended to whole days. If time__gte is not given
+        it continues from the last day counted, if time__lte is not given it
+        defaults to now.
+
+        The rows are counted with the given fields, all by default. The
+        keyword arguments are the filters of the source, as in query()
+        (name, serial, ...).
+
+        Returns the number of days counted.
+        """
+        key, source = self.get_key(db, table, **kw)
+        now = int(time.time())
+
+        with self.lock:
+            index = self.read(key)
+
+        # The last days may still change, count them again
+        stable = (now - self.recent) // DAY * DAY
+
+        start = to_timestamp(time__gte)
+        end = to_timestamp(time__lte)
+        if start is None:
+            if 'stable' not in index:
+                raise ValueError('time__gte is required to build the coverage index')
+            ranges = index['ranges']
+            start = min(ranges[-1][1], stable) if ranges else stable
+        if end is None:
+            end = now
+
+        start = start // DAY * DAY
+        end = (end // DAY + 1) * DAY
+        known = clip(index['ranges'], stable)
+        missing = subtract([(start, end)], known)
+
+        counts = {}
+        for a, b in missing:
+            data = query(
+                db, table=table, fields=fields,
+                time__gte=from_timestamp(a), time__lte=from_timestamp(b - 1),
+                limit=None, interval=DAY, interval_agg='count',
+                format='json', client=client, debug=debug, **kw
+            )
+            data = to_json(data)
+            if data['format'] == 'sparse':
+                rows = data['rows']
+            else:
+                rows = [dict(zip(data['columns'], row)) for row in data['rows']]
+
+            for row in rows:
+                day = row['time'] // DAY * DAY
+                values = [int(v) for k, v in row.items() if k != 'time' and v is not None]
+                counts[day] = max(values, default=0)
+
+        with self.lock:
+            index = self.read(key)
+            days = index['days']
+            for a, b in missing:
+                for day in range(a, b, DAY):
+                    days.pop(day, None)
+            days.update({day: count for day, count in counts.items() if count})
+
+            # Only the days before the stable boundary are final, the next
+            # ones are counted again by the next update, and until then they
+            # are not counted (they may have data)
+            ranges = clip(union(index['ranges'] + missing), stable)
+            index['days'] = {day: days[day] for day in sorted(days) if day < stable}
+            index['ranges'] = ranges
+            index['stable'] = stable
+            index['source'] = source
+            index['updated'] = now
+            self.write(key, index)
+
+        return sum((b - a) // DAY for a, b in missing)
+
+    def counts(self, db, table=None, time__gte=None, time__lte=None, **kw):
+        """
+        Returns a dictionary with the number of rows of every day (the Unix
+        timestamp of the day start) within the time range, None for the days
+        not counted yet. Without time range it returns the days counted.
+        """
+        key, source = self.get_key(db, table, **kw)
+        with self.lock:
+            index = self.read(key)
+
+        ranges = index['ranges']
+        if time__gte is not None or time__lte is not None:
+            start = to_timestamp(time__gte)
+            end = to_timestamp(time__lte)
+            start = ranges[0][0] if start is None and ranges else start
+            end = ranges[-1][1] - 1 if end is None and ranges else end
+            if start is None or end is None:
+                return {}
+            days = range(start // DAY * DAY, end + 1, DAY)
+        else:
+            days = [day for a, b in ranges for day in range(a, b, DAY)]
+
+        def get_count(day):
+            if any(a <= day < b for a, b in ranges):
+                return index['days'].get(day, 0)
+            return None
+
+        return {day: get_count(day) for day in days}
+
+    def get_filter(self, db, table=None, **kw):
+        """
+        Returns a function is_empty(start, end), which tells whether the time
+        range [start, end] (Unix timestamps) is known to have no data. Used by
+        query() to skip the empty chunks.
+        """
+        key, source = self.get_key(db, table, **kw)
+        with self.lock:
+            index = self.read(key)
+
+        ranges = index['ranges']
+        days = index['days']
+
+        def is_empty(start, end):
+            for day in range(start // DAY * DAY, end // DAY * DAY + 1, DAY):
+                if days.get(day) or not any(a <= day < b for a, b in ranges):
+                    return False
+            return True
+
+        return is_empty
+
+    def ranges(self, db, table=None, time__gte=None, time__lte=None, **kw):
+        """
+        Returns the list of right-open time ranges (Unix timestamps, whole
+        days) that may have data: those with rows, and those not counted yet.
+        """
+        counts = self.counts(db, table, time__gte, time__lte, **kw)
+        return union([(day, day + DAY) for day, count in counts.items() if count != 0])
+
+    def clear(self, db=None, table=None, **kw):
+        """
+        Removes the index of the given source, or all if no source is given.
+        """
+        import shutil
+
+        with self.lock:
+            if db is None:
+                shutil.rmtree(self.path, ignore_errors=True)
+            else:
+                key, source = self.get_key(db, table, **kw)
+                try:
+                    os.remove(os.path.join(self.path, f'{key}.json'))
+                except FileNotFoundError:
+                    pass
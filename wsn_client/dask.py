@@ -0,0 +1,122 @@
+"""
+Lazy Dask dataframes (pip install dask[dataframe]), for analyses that do not
+fit in memory, or that are spread over a cluster:
+
+    from wsn_client.dask import to_dask
+
+    ddf = to_dask('clickhouse', table='finseflux_Biomet',
+                  fields=['LWIN_6_14_1_1_1', 'LWOUT_6_15_1_1_1'],
+                  time__gte=datetime.datetime(2016, 1, 1, tzinfo=datetime.timezone.utc),
+                  time__lte=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+    ddf['LWIN_6_14_1_1_1'].resample('1D').mean().compute()
+
+Every partition is a query() call for one time window, and nothing is
+fetched until computed.
+"""
+
+import datetime
+import time
+
+from .query import get_time_index, query, split_range, to_timestamp
+
+
+def from_timestamp(x):
+    return datetime.datetime.fromtimestamp(x, datetime.timezone.utc)
+
+
+class Partition:
+    """
+    Loads one partition, the time range [start, end), or [start, end] if
+    last. Called by Dask, maybe in a worker of a distributed cluster, so it
+    must be picklable.
+    """
+
+    def __init__(self, db, meta, **kw):
+        self.db = db
+        self.meta = meta
+        self.kw = kw
+
+    def __call__(self, part):
+        start, end, last = part
+        df = query(self.db, time__gte=from_timestamp(start),
+                   time__lte=from_timestamp(end if last else end - 1),
+                   limit=None, format='pandas', time_index=True, **self.kw)
+
+        # The partitions must match the meta, e.g. with sparse data a
+        # partition may miss columns, or be empty
+        meta = self.meta
+        if len(df) == 0:
+            return meta
+
+        df = df.reindex(columns=meta.columns)
+        for name, dtype in meta.dtypes.items():
+            if df[name].dtype != dtype:
+                try:
+                    df[name] = df[name].astype(dtype)
+                except (TypeError, ValueError):
+                    pass
+
+        return df
+
+
+def to_dask(
+    db,                                     # postgresql or clickhouse
+    table=None,                             # clickhouse table name
+    fields=None,                            # Fields to return: all by default
+    time__gte=None, time__lte=None,         # Time range (sampled), time__gte is required
+    partition=datetime.timedelta(days=7),   # Time window of every partition (timedelta)
+    interval=None, interval_agg=None,       # Aggregates
+    meta=None,                              # Empty dataframe with the columns and dtypes
+    client=None,                            # WSNClient, the default one if not given
+    **kw                                    # Other parameters of query() and filters
+    ):
+    """
+    to_dask('clickhouse', table='', ...) -> dask dataframe
+    to_dask('postgresql', ...) -> dask dataframe
+
+    Returns a lazy Dask dataframe, where every partition is a query() call for
+    one time window of the given size, fetched when computed. The time range
+    is split as with the chunk parameter of query (see split_range): the
+    windows are aligned to multiples of the partition size since the Unix
+    epoch, and with the interval edges if an interval is given. If time__lte
+    is not given it defaults to now.
+
+    The index is the time (see query), with known divisions, the window
+    edges. So operations on a time slice only fetch the partitions within the
+    slice:
+
+        ddf.loc['2018-03-01':'2018-03-07'].compute()
+
+    Unless the meta parameter is given, the first rows are fetched right away
+    to know the columns and their dtypes. Columns not in the meta are
+    dropped from the partitions, so with sparse data (PostgreSQL) ask for the
+    fields, or pass the meta.
+
+    The other keyword arguments are passed to query(), e.g. the PostgreSQL
+    filters (name, serial, ...), schema, chunk, cache or stream. The client
+    is sent to the workers, without its session, if running in a distributed
+    cluster; by default the workers use their default client (the WSN_HOST
+    and WSN_TOKEN environment variables).
+    """
+    import dask.dataframe as dd
+
+    start = to_timestamp(time__gte)
+    end = to_timestamp(time__lte)
+    if start is None:
+        raise ValueError('to_dask requires time__gte')
+    if end is None:
+        end = int(time.time())
+
+    kw = dict(kw, table=table, fields=fields, interval=interval, interval_agg=interval_agg,
+              client=client)
+    if meta is None:
+        meta = query(db, time__gte=from_timestamp(start), time__lte=from_timestamp(end),
+                     limit=100, format='pandas', time_index=True, **kw).iloc[:0]
+
+    ranges = split_range(start, end, partition, interval)
+    parts = [(a, b, i == len(ranges) - 1) for i, (a, b) in enumerate(ranges)]
+    divisions = [a for a, b in ranges] + [ranges[-1][1]]
+    divisions = tuple(get_time_index(divisions))
+
+    return dd.from_map(Partition(db, meta, **kw), parts, meta=meta, divisions=divisions,
+                       label='wsn-query', enforce_metadata=False)
@@ -0,0 +1,235 @@
+"""
+Field discovery: which columns a source has, their types, and the time range
+of its data, without querying all the columns of all the rows.
+
+    describe('clickhouse', table='finseflux_Biomet')
+    describe('postgresql', name='sw-001')
+
+The descriptions are cached on disk, and used by query() to validate the
+fields requested. The path of the cache is given by the WSN_DESCRIBE
+environment variable, or by setting PATH in this module.
+"""
+
+import contextvars
+import datetime
+import hashlib
+import json
+import os
+import time
+
+from .cache import to_seconds
+from .client import get_client
+from .query import query, to_json
+
+
+# Default path of the cache
+PATH = os.getenv('WSN_DESCRIBE', '~/.cache/wsn_client/describe')
+
+# Default time to live of the cached descriptions
+TTL = datetime.timedelta(days=1)
+
+# Number of rows sampled
+SAMPLE = 100
+
+# query() warns when fields=None would return more columns than this
+WIDE = 50
+
+# False while describing, the queries made by describe are not validated
+validating = contextvars.ContextVar('validating', default=True)
+
+
+def get_path(db, table=None, client=None, path=None, **kw):
+    """
+    Returns the path to the cached description of the source.
+    """
+    if client is None:
+        client = get_client()
+    if path is None:
+        path = PATH
+
+    filters = {k: v for k, v in kw.items() if v is not None}
+    key = json.dumps([client.url(''), db, table, filters], sort_keys=True, default=str)
+    key = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(os.path.expanduser(path), f'{key}.json')
+
+
+def get_rows(data):
+    data = to_json(data)
+    if data['format'] == 'sparse':
+        return data['rows']
+
+    columns = data['columns']
+    return [dict(zip(columns, row)) for row in data['rows']]
+
+
+def get_type(values):
+    names = {bool: 'bool', int: 'int', float: 'float', str: 'str'}
+    types = {names.get(type(x), 'object') for x in values if x is not None}
+    if types == {'int', 'float'}:
+        return 'float'
+    if len(types) == 1:
+        return types.pop()
+    return 'mixed' if types else None
+
+
+def get_last(db, table, first, client, **kw):
+    """
+    Returns the last rows, narrowing down the time range with counts per
+    interval (30 days, 1 hour), so only a few small requests are needed. All
+    the columns are counted, in sparse sources any may be the last one with
+    data.
+    """
+    end = int(time.time())
+    for interval in (30 * 86400, 3600):
+        data = query(db, table=table,
+                     time__gte=from_timestamp(first), time__lte=from_timestamp(end),
+                     limit=None, interval=interval, interval_agg='count',
+                     format='json', client=client, **kw)
+        rows = [
+            row for row in get_rows(data)
+            if any(value for key, value in row.items() if key != 'time')
+        ]
+        if not rows:
+            return []
+        first = rows[-1]['time']
+        end = min(end, first + interval - 1)
+
+    data = query(db, table=table, time__gte=from_timestamp(first),
+                 time__lte=from_timestamp(end), limit=None, format='json', client=client,
+                 **kw)
+    return get_rows(data)
+
+
+def from_timestamp(x):
+    return datetime.datetime.fromtimestamp(x, datetime.timezone.utc)
+
+
+def describe(
+    db,                                     # postgresql or clickhouse
+    table=None,                             # clickhouse table name
+    ttl=TTL,                                # Time to live of the cached description
+    refresh=False,                          # Describe again, even if cached
+    path=None,                              # Path to the cache, PATH by default
+    client=None,                            # WSNClient, the default one if not given
+    **kw                                    # postgresql filters (name, serial, ...)
+    ):
+    """
+    describe('clickhouse', table='', ...) -> dict
+    describe('postgresql', ...) -> dict
+
+    Describes the source, returns a dictionary with:
+
+    - columns: the list of columns
+    - types: the type of every column, inferred from the values sampled
+      ('int', 'float', 'bool', 'str', 'mixed' or None if always null)
+    - first, last: the first and last times with data (Unix timestamps)
+    - described: when the description was made (Unix timestamp)
+
+    Instead of asking for all the columns of all the rows, a few small
+    requests are made: the first rows, and the last rows (found with
+    counts per interval). Note that in sparse sources (PostgreSQL) a column
+    may be missing from the sample.
+
+    The description is cached on disk for ttl, pass refresh=True to describe
+    the source again. query() uses the cached description, if any, to
+    validate the fields requested. It only looks in the default path (PATH),
+    so to change the path for both set PATH, or the WSN_DESCRIBE environment
+    variable.
+
+    Example:
+
+        >>> describe('postgresql', name='sw-001')['columns']
+    """
+    if client is None:
+        client = get_client()
+
+    filepath = get_path(db, table, client, path, **kw)
+    if not refresh:
+        description = read(filepath, ttl)
+        if description is not None:
+            return description
+
+    # Not validated against the old description, it's replaced once the new
+    # one is ready, so if a request fails the old one is kept
+    token = validating.set(False)
+    try:
+        rows = get_rows(query(db, table=table, limit=SAMPLE, format='json', client=client, **kw))
+        first = rows[0]['time'] if rows else None
+        last = None
+        if rows:
+            rows += get_last(db, table, first, client, **kw)
+            last = rows[-1]['time']
+    finally:
+        validating.reset(token)
+
+    columns = list(dict.fromkeys(k for row in rows for k in row))
+    description = {
+        'db': db,
+        'table': table,
+        'filters': {k: v for k, v in kw.items() if v is not None},
+        'columns': columns,
+        'types': {name: get_type([row.get(name) for row in rows]) for name in columns},
+        'first': first,
+        'last': last,
+        'described': time.time(),
+    }
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp = f'{filepath}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(description, f, default=str)
+    os.replace(tmp, filepath)
+
+    return description
+
+
+def read(filepath, ttl=TTL):
+    """
+    Returns the cached description, None if not cached or expired.
+    """
+    try:
+        with open(filepath) as f:
+            description = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if ttl is not None and time.time() > description['described'] + to_seconds(ttl):
+        return None
+
+    return description
+
+
+def validate(db, table=None, fields=None, client=None, path=None, ttl=TTL, **kw):
+    """
+    Validates the fields requested against the cached description of the
+    source, if any: unknown fields are an error with ClickHouse, and a
+    warning with PostgreSQL (the description is a sample). Warns if no
+    fields are requested and the source has many columns.
+
+    Once the description is older than ttl unknown fields are only a warning,
+    because the columns may have changed on the server since.
+    """
+    if not validating.get():
+        return
+
+    description = read(get_path(db, table, client, path, **kw), ttl=None)
+    if description is None:
+        return
+
+    expired = time.time() > description['described'] + to_seconds(ttl)
+
+    columns = description['columns']
+    if fields is None:
+        if len(columns) > WIDE:
+            print(f'WARNING: fields=None returns {len(columns)} columns, '
+                  f'ask only for the fields you need')
+        return
+
+    unknown = [x for x in fields if x not in columns]
+    if unknown:
+        message = f'unknown fields {unknown}, see describe()'
+        if db == 'clickhouse' and not expired:
+            raise ValueError(message)
+        if expired:
+            message = f'{message} (the description has expired, describe again with refresh=True)'
+        print(f'WARNING: {message}')
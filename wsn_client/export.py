@@ -0,0 +1,322 @@
+"""
+The wsn-query command, exports the result of a query to CSV, NDJSON or
+Parquet, e.g.
+
+    wsn-query clickhouse --table finseflux_Biomet --fields LWIN_6_14_1_1_1 LWOUT_6_15_1_1_1 \\
+        --since 2018-03-01 --until 2018-04-01 -o biomet.csv
+
+    wsn-query postgresql --filter name=sw-001 --since 2018-03-01 --format parquet -o sw-001.parquet
+
+The result is fetched page by page (see iter_query), and every page written
+before fetching the next, so memory use is constant whatever the size of the
+result. Progress is shown on stderr.
+
+CSV and Parquet need the columns (and with Parquet their types) before the
+first page is written. They are the fields given, or else those of the
+source description (see wsn_client.describe). If a page has columns not known
+in advance, or values that cannot be written with the column type, the export
+stops with an error, instead of dropping data.
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import time
+
+from .query import iter_query
+
+
+FORMATS = {
+    # Format: format of iter_query
+    'csv': 'pandas',
+    'ndjson': 'json',
+    'parquet': 'arrow',
+}
+
+# The filters with integer values
+INT_FILTERS = ('serial', 'source_addr_long')
+
+
+def parse_datetime(text):
+    """
+    Parses an ISO 8601 date or datetime, UTC unless the timezone is given.
+    """
+    value = datetime.datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def parse_filter(text):
+    """
+    Parses a filter KEY=VALUE. The values of the integer filters (serial and
+    source_addr_long) may be given in hexadecimal, the others are strings.
+    """
+    key, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'expected KEY=VALUE, got {text!r}')
+
+    if key in INT_FILTERS:
+        try:
+            value = int(value, 0)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'{key} must be an integer, got {value!r}')
+
+    return key, value
+
+
+class CSVWriter:
+    """
+    Writes the given columns, in every page the missing columns are empty.
+    """
+
+    def __init__(self, file, columns, types=None):
+        self.file = file
+        self.columns = columns
+        self.header = True
+
+    def write(self, df):
+        check_columns(self.columns, df.columns)
+        df = df.reindex(columns=self.columns)
+        df.to_csv(self.file, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+
+class NDJSONWriter:
+
+    def __init__(self, file, columns=None, types=None):
+        self.file = file
+
+    def write(self, data):
+        if data['format'] == 'sparse':
+            rows = data['rows']
+        else:
+            columns = data['columns']
+            rows = (dict(zip(columns, row)) for row in data['rows'])
+
+        for row in rows:
+            self.file.write(json.dumps(row))
+            self.file.write('\n')
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """
+    Writes every page as a row group, with the given columns and types. In
+    every page the missing columns are null, and the values are cast to the
+    column type.
+    """
+
+    def __init__(self, file, columns, types):
+        import pyarrow as pa
+
+        self.file = file
+        self.schema = pa.schema([(name, types[name]) for name in columns])
+        self.writer = None
+
+    def write(self, table):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        check_columns(self.schema.names, table.column_names)
+
+        arrays = {}
+        for field in self.schema:
+            if field.name not in table.column_names:
+                arrays[field.name] = pa.nulls(table.num_rows, field.type)
+                continue
+
+            array = table.column(field.name)
+            try:
+                arrays[field.name] = array.cast(field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                raise ValueError(f'column {field.name} has {array.type} values, '
+                                 f'cannot be written as {field.type}')
+
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.file, self.schema)
+        self.writer.write_table(pa.table(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def check_columns(columns, page):
+    extra = [x for x in page if x not in columns]
+    if extra:
+        raise ValueError(f'columns {extra} not known in advance, pass them with --fields')
+
+
+def get_types(db, types):
+    """
+    Returns the Arrow types of the columns, from the types of the source
+    description. The types are widened, so the values of any page fit: with
+    PostgreSQL (JSON values) integers may be followed by floats, so numbers
+    are float64, as are the columns of unknown type (always null in the
+    sample). Columns with mixed types are strings.
+    """
+    import pyarrow as pa
+
+    integer = pa.int64() if db == 'clickhouse' else pa.float64()
+    arrow_types = {
+        'bool': pa.bool_(), 'int': integer, 'float': pa.float64(),
+        'str': pa.string(), 'mixed': pa.string(), None: pa.float64(),
+    }
+    types = {name: arrow_types.get(type, pa.string()) for name, type in types.items()}
+    types['time'] = pa.int64()
+    return types
+
+
+def get_columns(args, format):
+    """
+    Returns the columns to write, and their types (with Parquet), from the
+    fields given or from the description of the source.
+    """
+    if format == 'ndjson':
+        return None, None
+
+    columns = None
+    if args.fields:
+        columns = ['time'] + (args.tags or []) + args.fields
+
+    types = {}
+    if columns is None or format == 'parquet':
+        from .describe import describe
+
+        description = describe(args.db, table=args.table, **dict(args.filters))
+        if columns is None:
+            columns = description['columns'] + (args.tags or [])
+        types = description['types']
+
+    columns = list(dict.fromkeys(columns))
+    if format == 'parquet':
+        types = get_types(args.db, {name: types.get(name) for name in columns})
+
+    return columns, types
+
+
+WRITERS = {
+    'csv': CSVWriter,
+    'ndjson': NDJSONWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def get_rows(data):
+    if isinstance(data, dict):
+        return len(data['rows'])
+    return len(data)
+
+
+class Progress:
+    """
+    Prints the number of rows and the throughput to stderr.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.tty = sys.stderr.isatty()
+        self.t0 = time.perf_counter()
+        self.pages = 0
+        self.rows = 0
+
+    def update(self, rows):
+        self.pages += 1
+        self.rows += rows
+        if self.enabled:
+            end = '\r' if self.tty else '\n'
+            print(self.get_line(), end=end, file=sys.stderr, flush=True)
+
+    def get_line(self):
+        elapsed = time.perf_counter() - self.t0
+        speed = self.rows / elapsed if elapsed else 0
+        return (f'{self.rows} rows, {self.pages} pages in {elapsed:.1f} seconds '
+                f'({speed:.0f} rows/s)')
+
+    def close(self):
+        if self.enabled and self.tty:
+            print(file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export WSN data to CSV, NDJSON or Parquet',
+        epilog='Times are ISO 8601 dates or datetimes, UTC unless a timezone is given',
+    )
+    parser.add_argument('db', choices=['clickhouse', 'postgresql'])
+    parser.add_argument('--table', help='ClickHouse table name')
+    parser.add_argument('--fields', nargs='+', help='Fields to return, all by default')
+    parser.add_argument('--tags', nargs='+', help='PostgreSQL metadata fields')
+    parser.add_argument('--filter', dest='filters', action='append', type=parse_filter,
+                        default=[], metavar='KEY=VALUE',
+                        help='PostgreSQL filter, e.g. name=sw-001 (may be repeated)')
+    parser.add_argument('--since', type=parse_datetime, help='Sampled time, from (time__gte)')
+    parser.add_argument('--until', type=parse_datetime, help='Sampled time, to (time__lte)')
+    parser.add_argument('--received-since', type=parse_datetime,
+                        help='Received time, from (received__gte)')
+    parser.add_argument('--received-until', type=parse_datetime,
+                        help='Received time, to (received__lte)')
+    parser.add_argument('--interval', type=int, help='Interval size in seconds')
+    parser.add_argument('--interval-agg', help='Aggregate within the interval, e.g. avg')
+    parser.add_argument('--limit', type=int, help='Maximum number of rows, all by default')
+    parser.add_argument('--page-size', type=int, default=10000, help='Rows per request')
+    parser.add_argument('--format', choices=list(FORMATS), default=None,
+                        help='Output format, guessed from the output file name, csv by default')
+    parser.add_argument('-o', '--output', help='Output file, stdout by default')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not show progress')
+    args = parser.parse_args(argv)
+
+    format = args.format
+    if format is None:
+        suffix = (args.output or '').rpartition('.')[2].lower()
+        format = suffix if suffix in FORMATS else 'csv'
+
+    # Parquet is binary
+    if args.output is None:
+        file = sys.stdout.buffer if format == 'parquet' else sys.stdout
+    elif format == 'parquet':
+        file = open(args.output, 'wb')
+    else:
+        file = open(args.output, 'w', newline='')
+
+    columns, types = get_columns(args, format)
+    writer = WRITERS[format](file, columns, types)
+    progress = Progress(enabled=not args.quiet)
+    pages = iter_query(
+        args.db, table=args.table, fields=args.fields, tags=args.tags,
+        time__gte=args.since, time__lte=args.until,
+        received__gte=args.received_since, received__lte=args.received_until,
+        limit=args.limit, interval=args.interval, interval_agg=args.interval_agg,
+        format=FORMATS[format], time_index=False, page_size=args.page_size,
+        **dict(args.filters)
+    )
+
+    try:
+        for page in pages:
+            writer.write(page)
+            progress.update(get_rows(page))
+        writer.close()
+        progress.close()
+    except ValueError as exc:
+        progress.close()
+        sys.exit(f'ERROR: {exc}')
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        # e.g. wsn-query ... | head
+        sys.stderr.close()
+        sys.exit(1)
+    finally:
+        if args.output is not None:
+            file.close()
+
+
+if __name__ == '__main__':
+    main()
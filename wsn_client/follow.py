@@ -0,0 +1,100 @@
+import json
+import time
+
+from .client import get_client
+from .query import convert, get_params, to_json, to_timestamp
+
+
+def follow(
+    db,                                     # postgresql or clickhouse
+    table=None,                             # clickhouse table name
+    fields=None,                            # Fields to return: all by default
+    tags=None,                              # postgresql metadata fields (none by default)
+    time__gte=None, time__lte=None,         # Time range (sampled)
+    received__gte=None,                     # Start following from (now by default)
+    format='pandas',                        # pandas, json, arrow or polars
+    time_index=True,                        # Return pandas dataframe with time as index
+                                            # (only valid if format 'pandas' is selected)
+    poll_interval=10,                       # Seconds between polls
+    max_interval=300,                       # Maximum seconds between polls (backoff)
+    overlap=60,                             # Seconds the polls overlap
+    client=None,                            # WSNClient, the default one if not given
+    debug=False,
+    **kw                                    # postgresql filters (name, serial, ...)
+    ):
+    """
+    follow('clickhouse', table='', ...) -> iterator of dataframes or dicts
+    follow('postgresql', ...) -> iterator of dataframes or dicts
+
+    Follows the data as it's received by the server, yielding only the new
+    rows. This is an infinite iterator, break out of the loop to stop.
+
+    Every poll requests the rows received since the previous poll, using the
+    received time as a watermark, instead of the sampled time. So the data
+    already downloaded is not downloaded again, and the rows sampled long ago
+    but received late are not missed.
+
+    Consecutive polls overlap by some seconds (the overlap parameter), so the
+    rows written to the database while the previous poll was running are not
+    missed. The rows in the overlap already yielded are discarded.
+
+    When no new rows arrive the time between polls is doubled, up to
+    max_interval seconds; it goes back to poll_interval as soon as new rows
+    arrive.
+
+    Note that frames without a received time, for example those uploaded to
+    the server from the SD card, are not returned.
+
+    Example:
+
+        for df in follow('clickhouse', table='finseflux_Biomet',
+                         fields=['LWIN_6_14_1_1_1', 'LWOUT_6_15_1_1_1']):
+            print(df)
+    """
+
+    if client is None:
+        client = get_client()
+
+    url = client.url(f'/api/query/{db}/')
+
+    params = get_params(
+        table=table, fields=fields, tags=tags,
+        time__gte=time__gte, time__lte=time__lte,
+        limit=None,
+        **kw
+    )
+
+    watermark = to_timestamp(received__gte)
+    if watermark is None:
+        watermark = int(time.time())
+
+    seen = set()
+    delay = poll_interval
+    while True:
+        now = int(time.time())
+        response, data = client.get(url, dict(params, received__gte=watermark - overlap))
+        data = to_json(data)
+
+        # Discard the rows already yielded by the previous poll
+        rows = []
+        keys = set()
+        for row in data['rows']:
+            key = json.dumps(row, sort_keys=True)
+            keys.add(key)
+            if key not in seen:
+                rows.append(row)
+
+        seen = keys
+        watermark = now
+
+        if debug:
+            print(f'{response.request.url}')
+            print(f'Returns {len(rows)} new rows (of {len(keys)})')
+
+        if rows:
+            delay = poll_interval
+            yield convert(dict(data, rows=rows), format, time_index)
+        else:
+            delay = min(delay * 2, max_interval)
+
+        time.sleep(delay)
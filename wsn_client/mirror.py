@@ -0,0 +1,348 @@
+"""
+Local mirror of the data, in a Parquet dataset (requires pyarrow), to run
+analytical scans without going to the server.
+
+The dataset is partitioned by source and day (UTC):
+
+    {path}/clickhouse/finseflux_Biomet/day=2018-03-01/data.parquet
+    {path}/postgresql/name=sw-001/day=2018-03-01/data.parquet
+
+It's updated with the wsn-sync command, or the sync function:
+
+    wsn-sync --since 2018-01-01 clickhouse:finseflux_Biomet postgresql:name=sw-001
+
+The first time a source is mirrored all its data (since the given date) is
+downloaded, the next times only the data received since the previous sync.
+Then query_local() reads from the mirror, like query() does from the server:
+
+    df = query_local('postgresql', name='sw-001', fields=['bat'],
+                     time__gte=datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc))
+"""
+
+import argparse
+import datetime
+import json
+import os
+import time
+import urllib.parse
+
+from .query import convert, get_params, iter_query
+
+
+DAY = 86400
+
+# Default path of the mirror
+PATH = os.getenv('WSN_MIRROR', '~/.local/share/wsn_client/mirror')
+
+# The PostgreSQL filters that identify a source, by order of preference
+SOURCE_KEYS = ['name', 'serial', 'source_addr_long']
+
+
+def get_source(db, table=None, **kw):
+    """
+    Returns the directory of the source, relative to the mirror, and the
+    filters not used to identify the source.
+    """
+    if db == 'clickhouse':
+        if table is None:
+            raise ValueError('clickhouse requires table')
+        return os.path.join(db, urllib.parse.quote(table, safe='')), kw
+
+    for key in SOURCE_KEYS:
+        if kw.get(key) is not None:
+            value = kw.pop(key)
+            source = urllib.parse.quote(f'{key}={value}', safe='=')
+            return os.path.join(db, source), kw
+
+    raise ValueError(f'postgresql requires one of {SOURCE_KEYS}')
+
+
+def parse_source(text):
+    """
+    Parses a source given in the command line, e.g. clickhouse:finseflux_Biomet
+    or postgresql:name=sw-001
+    """
+    db, sep, rest = text.partition(':')
+    if db == 'clickhouse':
+        return {'db': db, 'table': rest}
+
+    if db == 'postgresql' and '=' in rest:
+        key, value = rest.split('=', 1)
+        if key in ('serial', 'source_addr_long'):
+            value = int(value, 0)
+        return {'db': db, key: value}
+
+    raise ValueError(f'unexpected source {text!r}, expected clickhouse:TABLE or postgresql:KEY=VALUE')
+
+
+def get_day(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def read_state(dirpath):
+    try:
+        with open(os.path.join(dirpath, 'state.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_state(dirpath, state):
+    path = os.path.join(dirpath, 'state.json')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def write_day(dirpath, day, table):
+    """
+    Adds the rows to the partition of the day, the duplicates are dropped.
+
+    With the sparse format every page may have a different set of columns,
+    and a column with integers in one page may have floats in another, so
+    the schemas are merged: missing columns are filled with nulls, and the
+    types are widened.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = os.path.join(dirpath, f'day={day}', 'data.parquet')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        table = pa.concat_tables([pq.read_table(path), table], promote_options='permissive')
+
+    df = table.to_pandas()
+    df = df.drop_duplicates().sort_values('time', kind='stable')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    tmp = f'{path}.tmp'
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+def write(dirpath, table):
+    """
+    Writes the rows to the partitions of their days.
+    """
+    import pyarrow.compute as pc
+
+    if table.num_rows == 0:
+        return
+
+    days = pc.divide(table.column('time').cast('int64'), DAY)
+    for day in pc.unique(days).to_pylist():
+        mask = pc.equal(days, day)
+        write_day(dirpath, get_day(day * DAY), table.filter(mask))
+
+
+def sync(
+    sources,                                # List of sources, dicts with db, table or name...
+    path=PATH,                              # Path to the mirror
+    since=None,                             # First time to mirror (datetime), all by default
+    fields=None,                            # Fields to mirror: all by default
+    overlap=3600,                           # Seconds the syncs overlap
+    page_size=10000,                        # Rows per request
+    client=None,                            # WSNClient, the default one if not given
+    debug=False,
+    ):
+    """
+    sync(sources, path, ...)
+
+    Mirrors the given sources into the local Parquet dataset at path. Every
+    source is a dictionary with the parameters of query() that identify it:
+    db and table for ClickHouse, db and name (or serial, or
+    source_addr_long) for PostgreSQL, e.g.
+
+        sync([
+            {'db': 'clickhouse', 'table': 'finseflux_Biomet'},
+            {'db': 'postgresql', 'name': 'sw-001'},
+        ], since=datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc))
+
+    The first sync downloads all the data since the given time, the next
+    ones only the data received (received time) since the previous sync,
+    minus the overlap. The received time is the watermark, so rows sampled
+    long ago but received late are mirrored as well. Note that frames without
+    a received time (e.g. uploaded from the SD card) are only mirrored by the
+    first sync.
+
+    The data is downloaded page by page (see iter_query), so memory use is
+    bounded.
+    """
+    path = os.path.expanduser(path)
+
+    for spec in sources:
+        spec = dict(spec)
+        db = spec.pop('db')
+        table = spec.pop('table', None)
+        source, filters = get_source(db, table, **spec)
+        dirpath = os.path.join(path, source)
+        os.makedirs(dirpath, exist_ok=True)
+
+        state = read_state(dirpath)
+        now = int(time.time())
+        if state is None:
+            params = {'time__gte': since}
+        else:
+            received = datetime.datetime.fromtimestamp(state['received'] - overlap,
+                                                       datetime.timezone.utc)
+            params = {'received__gte': received}
+
+        t0 = time.perf_counter()
+        rows = 0
+        for page in iter_query(db, table=table, fields=fields, limit=None,
+                               format='arrow', time_index=False, page_size=page_size,
+                               client=client, **params, **spec):
+            write(dirpath, page)
+            rows += page.num_rows
+
+        write_state(dirpath, {'source': dict(spec, db=db, table=table), 'received': now})
+        if debug:
+            print(f'{source}: {rows} rows in {(time.perf_counter()-t0):.2f} seconds')
+
+
+def query_local(
+    db,                                     # postgresql or clickhouse
+    table=None,                             # clickhouse table name
+    fields=None,                            # Fields to return: all by default
+    tags=None,                              # postgresql metadata fields (none by default)
+    time__gte=None, time__lte=None,         # Time range (sampled)
+    received__gte=None, received__lte=None, # Time range (received)
+    limit=100,                              # Limit
+    interval=None, interval_agg=None,       # Aggregates
+    format='pandas',                        # pandas, json, arrow or polars
+    time_index=True,                        # Return pandas dataframe with time as index
+                                            # (only valid if format 'pandas' is selected)
+    schema=None,                            # Schema (or name) to build the pandas dataframe
+    path=PATH,                              # Path to the mirror
+    chunk=None, workers=None, cache=None,   # Ignored, for compatibility with query()
+    coverage=None, memo=None, client=None,
+    hook=None, sparse_dtype=None,
+    debug=False,
+    **kw                                    # postgresql filters (name, serial, ...)
+    ):
+    """
+    query_local('clickhouse', table='', ...) -> dataframe or dict
+    query_local('postgresql', ...) -> dataframe or dict
+
+    Like query(), but reads the data from the local mirror (see sync),
+    without going to the server. See query() for the parameters, those about
+    fetching and decoding (chunk, workers, cache, coverage, memo, client, hook
+    and sparse_dtype) are accepted and ignored, so query_local can replace
+    query.
+
+    Only the partitions (days) within the time range are read, and from them
+    only the requested fields. Intervals and aggregates are computed locally
+    with wsn_client.resample.
+
+    The tags, and the received time range, are only supported if the
+    mirrored data has those columns.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    t0 = time.perf_counter()
+
+    params = get_params(time__gte=time__gte, time__lte=time__lte,
+                        received__gte=received__gte, received__lte=received__lte)
+    start, end = params['time__gte'], params['time__lte']
+
+    source, filters = get_source(db, table, **kw)
+    dirpath = os.path.join(os.path.expanduser(path), source)
+    if not os.path.isdir(dirpath):
+        raise ValueError(f'{source} is not in the mirror {path}')
+
+    # Partition pruning
+    first = None if start is None else get_day(start)
+    last = None if end is None else get_day(end)
+    days = sorted(
+        name[4:] for name in os.listdir(dirpath)
+        if name.startswith('day=')
+        and (first is None or name[4:] >= first)
+        and (last is None or name[4:] <= last)
+    )
+
+    # Columns to read, and row filters
+    columns = None
+    if fields is not None:
+        columns = ['time'] + list(fields) + list(tags or [])
+        columns += [x for x in filters if x not in columns]
+        if received__gte is not None or received__lte is not None:
+            columns.append('received')
+
+    conditions = [
+        ('time', pc.greater_equal, start), ('time', pc.less_equal, end),
+        ('received', pc.greater_equal, params['received__gte']),
+        ('received', pc.less_equal, params['received__lte']),
+    ] + [(name, pc.equal, value) for name, value in filters.items()]
+
+    tables = []
+    for day in days:
+        filepath = os.path.join(dirpath, f'day={day}', 'data.parquet')
+        names = pq.read_schema(filepath).names
+        table = pq.read_table(filepath, columns=[x for x in columns if x in names]
+                              if columns is not None else None)
+        for name, function, value in conditions:
+            if value is None:
+                continue
+            if name not in table.column_names:
+                raise ValueError(f'cannot filter by {name!r}, not in the mirrored data')
+            table = table.filter(function(table.column(name), value))
+        tables.append(table)
+
+    if tables:
+        table = pa.concat_tables(tables, promote_options='permissive')
+    else:
+        table = pa.table({'time': pa.array([], pa.int64())})
+
+    # The filter columns are not returned, unless requested
+    if columns is not None:
+        requested = ['time'] + list(fields) + list(tags or [])
+        table = table.select([x for x in table.column_names if x in requested])
+
+    if interval:
+        from .resample import resample
+
+        df = resample(table.to_pandas(), interval, interval_agg, time_index=False)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if limit is not None:
+        table = table.slice(0, limit)
+
+    data = convert({'format': 'arrow', 'table': table}, format, time_index, schema)
+
+    if debug:
+        print(f'Read {len(days)} partitions of {source} in {(time.perf_counter()-t0):.2f} seconds')
+        print()
+        print(data)
+        print()
+
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Mirror WSN data into a local Parquet dataset',
+        epilog='Sources are given as clickhouse:TABLE or postgresql:KEY=VALUE, '
+               'where KEY is name, serial or source_addr_long',
+    )
+    parser.add_argument('sources', nargs='+', type=parse_source, help='Sources to mirror')
+    parser.add_argument('--path', default=PATH, help=f'Path to the mirror (default {PATH})')
+    parser.add_argument('--since', type=datetime.date.fromisoformat,
+                        help='First day to mirror (YYYY-MM-DD), all by default')
+    parser.add_argument('--fields', nargs='+', help='Fields to mirror, all by default')
+    parser.add_argument('--page-size', type=int, default=10000, help='Rows per request')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    since = args.since
+    if since is not None:
+        since = datetime.datetime.combine(since, datetime.time(), datetime.timezone.utc)
+
+    sync(args.sources, path=args.path, since=since, fields=args.fields,
+         page_size=args.page_size, debug=args.debug)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Quality controlled data API (/api/qc/), authenticated with an API key, see
+WSNClient.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from .cache import Cache
+from .client import get_client
+from .query import convert, merge, split_range, to_timestamp
+
+
+def to_records_json(df):
+    """
+    Serializes the dataframe as a JSON array of records. The time column, or
+    the index if it's a DatetimeIndex, is converted to Unix timestamps.
+    """
+    import pandas as pd
+
+    if 'time' not in df.columns and isinstance(df.index, pd.DatetimeIndex):
+        df = df.rename_axis('time').reset_index()
+
+    if pd.api.types.is_datetime64_any_dtype(df['time']):
+        times = df['time']
+        if times.dt.tz is not None:
+            times = times.dt.tz_convert('UTC').dt.tz_localize(None)
+        df = df.assign(time=times.astype('datetime64[s]').astype('int64'))
+
+    return df.to_json(orient='records', double_precision=15)
+
+
+def get_fingerprint(name, df, batch_rows):
+    """
+    Identifies the upload, to resume only the same upload.
+    """
+    import pandas as pd
+
+    digest = hashlib.sha1(f'{name}:{batch_rows}:{len(df)}:{list(df.columns)}'.encode())
+    digest.update(pd.util.hash_pandas_object(df).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """
+    Keeps the list of batches already uploaded in a JSON file.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.done = set()
+
+        if path is not None:
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                pass
+            else:
+                if data['fingerprint'] == fingerprint:
+                    self.done = set(data['done'])
+
+    def add(self, i):
+        with self.lock:
+            self.done.add(i)
+            if self.path is not None:
+                tmp = f'{self.path}.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump({'fingerprint': self.fingerprint, 'done': sorted(self.done)}, f)
+                os.replace(tmp, self.path)
+
+    def remove(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def qc_upload(
+    name,                                   # Name of the QC dataset
+    df,                                     # Dataframe with the time column (or index)
+    batch_rows=10000,                       # Number of rows per request
+    workers=4,                              # Number of batches uploaded concurrently
+    compress=True,                          # Gzip the request bodies
+    checkpoint=None,                        # Path to the checkpoint file
+    retries=3,                              # Retries per batch
+    backoff=1,                              # Backoff factor (seconds)
+    client=None,                            # WSNClient, the default one if not given
+    debug=False,
+    ):
+    """
+    qc_upload(name, df, ...) -> list of responses
+
+    Uploads the quality controlled data in the dataframe to /api/qc/upload/.
+
+    The dataframe has one row per time, with the time column as a Unix
+    timestamp or a datetime (or a DatetimeIndex), and the data columns. The
+    data is split in batches of batch_rows rows, which are uploaded
+    concurrently, every batch is retried (with exponential backoff) if the
+    upload fails.
+
+    The request bodies are gzipped (Content-Encoding: gzip), pass
+    compress=False if the server does not accept compressed requests.
+
+    If the checkpoint parameter is given, the batches uploaded are recorded in
+    that file. So if the upload is interrupted, calling again qc_upload with
+    the same arguments resumes where it stopped. The checkpoint file is
+    removed once all the batches are uploaded.
+
+    Example:
+
+        qc_upload('sw-001', df, checkpoint='sw-001.upload.json')
+
+    Returns the list of the responses from the server, one per batch
+    uploaded (batches uploaded in a previous run are skipped, and return
+    None). If some batches still fail after the retries, the first error is
+    raised once the other batches are done.
+    """
+
+    if client is None:
+        client = get_client()
+
+    url = client.url('/api/qc/upload/')
+    n = -(-len(df) // batch_rows)
+
+    state = Checkpoint(checkpoint, get_fingerprint(name, df, batch_rows))
+    prefix = f'[{{"name": {json.dumps(name)}, "data": '.encode()
+
+    headers = {'Content-Type': 'application/json'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+
+    def upload(i):
+        batch = df.iloc[i * batch_rows:(i + 1) * batch_rows]
+        body = prefix + to_records_json(batch).encode() + b'}]'
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+
+        for attempt in range(retries + 1):
+            try:
+                t0 = time.perf_counter()
+                response, data = client.post(url, body, headers=headers)
+            except requests.RequestException as exc:
+                # Do not retry client errors (4xx), except 429
+                response = getattr(exc, 'response', None)
+                status = getattr(response, 'status_code', None)
+                if attempt == retries or (status and status < 500 and status != 429):
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+            else:
+                state.add(i)
+                if debug:
+                    print(f'Batch {i + 1}/{n}: {len(batch)} rows, {len(body)} bytes '
+                          f'in {(time.perf_counter()-t0):.2f} seconds')
+                return data
+
+    results = [None] * n
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            i: executor.submit(upload, i) for i in range(n) if i not in state.done
+        }
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except Exception as exc:
+                errors.append(exc)
+
+    if errors:
+        raise errors[0]
+
+    state.remove()
+    return results
+
+
+def normalize(data):
+    """
+    The QC data is a list of records, or a dictionary of columns. Returns it
+    in the format of /api/query/.
+    """
+    if isinstance(data, list):
+        return {'format': 'sparse', 'rows': data}
+
+    if 'rows' in data:
+        return data
+
+    columns = list(data)
+    rows = [list(row) for row in zip(*data.values())]
+    return {'format': 'dense', 'columns': columns, 'rows': rows}
+
+
+def qc_download(
+    name,                                   # Name of the QC dataset
+    since=None, until=None,                 # Time range [since, until)
+    format='pandas',                        # pandas, json, arrow or polars
+    time_index=True,                        # Return pandas dataframe with time as index
+    chunk=None, workers=4,                  # Split the time range in chunks (timedelta)
+                                            # fetched concurrently
+    cache=None,                             # Cache object (or path) to store the results
+    client=None,                            # WSNClient, the default one if not given
+    debug=False,
+    ):
+    """
+    qc_download(name, since, until, ...) -> dataframe or dict
+
+    Downloads the quality controlled data from /api/qc/download/, within the
+    time range [since, until) (datetime objects). The result is like that of
+    query(): by default a dataframe with the time column (Unix timestamps),
+    and the time as index.
+
+    As with query(), the time range can be split in chunks fetched
+    concurrently (chunk and workers parameters), and the results can be
+    cached on disk (cache parameter), then only the time ranges not in the
+    cache are downloaded. Both require since, if until is not given it
+    defaults to now.
+
+    Example:
+
+        df = qc_download(
+            'sw-001',
+            since=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+            until=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+            chunk=datetime.timedelta(days=30),
+            cache='~/.cache/wsn_client',
+        )
+    """
+
+    t0 = time.perf_counter()
+
+    if client is None:
+        client = get_client()
+
+    url = client.url(f'/api/qc/download/{name}/')
+    since = to_timestamp(since)
+    until = to_timestamp(until)
+
+    def fetch_range(start, end):
+        params = {'time__gte': start, 'time__lt': end}
+        response, data = client.get(url, params, auth='api_key')
+        if debug:
+            print(f'{response.request.url}')
+        return normalize(data)
+
+    def fetch(start, end):
+        if chunk is None:
+            return fetch_range(start, end)
+
+        ranges = split_range(start, end, chunk)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fetch_range, a, b) for a, b in ranges]
+            return merge([future.result() for future in futures])
+
+    if chunk is None and cache is None:
+        data = fetch_range(since, until)
+    else:
+        if since is None:
+            raise ValueError('chunk and cache require since')
+        if until is None:
+            until = int(time.time())
+
+        if cache is None:
+            data = fetch(since, until)
+        else:
+            if isinstance(cache, str):
+                cache = Cache(cache)
+
+            key = cache.get_key(url)
+            for start, end in cache.missing(key, since, until):
+                cache.store(key, start, end, fetch(start, end))
+
+            data = cache.load(key, since, until)
+
+    data = convert(data, format, time_index)
+
+    if debug:
+        print(f'Returns in {(time.perf_counter()-t0):.2f} seconds')
+        print()
+        print(data)
+        print()
+
+    return data
@@ -1,30 +1,556 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
-import os
 import time
 
-import pandas as pd
-import requests
+from .cache import Cache, align
+from .client import get_client
+from .schema import get_schema
+from .stats import Stats, get_rows
 
 
-# The host must be defined with an environement variable
-# e.g. export WSN_HOST="http://localhost:8000"
-HOST = os.getenv('WSN_HOST')
-if HOST is None:
-    print('Error: define the WSN_HOST environment variable')
+def __getattr__(name):
+    # Backwards compatibility, these used to be set at import time
+    if name == 'HOST':
+        return get_client().url('')
+    if name == 'TOKEN':
+        return get_client().headers['Authorization'].split()[-1]
+    if name == 'session':
+        return get_client().session
 
-# The token must be defined with an environement variable
-# e.g. export WSN_TOKEN="...."
-TOKEN = os.getenv('WSN_TOKEN')
-if TOKEN is None:
-    print('Error: define the WSN_TOKEN environment variable')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-if HOST is None or TOKEN is None:
-    exit(1)
 
+def to_timestamp(x):
+    return int(x.timestamp()) if x else x
+
+
+# Parameters of query() and friends that are not sent to the server, they
+# must not be taken for filters by the functions that don't support them
+OPTIONS = {
+    'format', 'time_index', 'schema', 'sparse_dtype', 'chunk', 'workers', 'stream',
+    'cache', 'coverage', 'memo', 'client', 'session', 'hook', 'page_size', 'debug',
+}
+
+
+def get_params(table=None, fields=None, tags=None, time__gte=None,
+               time__lte=None, received__gte=None, received__lte=None,
+               limit=100, interval=None, interval_agg=None, **kw):
+    """
+    Returns the query string parameters, as expected by the server. The
+    keyword arguments are the filters, those named like an option of query()
+    are an error (the caller does not support that option).
+    """
+    for key in kw:
+        if key in OPTIONS:
+            raise TypeError(f'unexpected keyword argument {key!r}')
+
+    time__gte = to_timestamp(time__gte)
+    time__lte = to_timestamp(time__lte)
+    received__gte = to_timestamp(received__gte)
+    received__lte = to_timestamp(received__lte)
+
+    if interval_agg == 'mean':
+        interval_agg = 'avg'
+
+    params = {
+        'table': table,
+        'fields': fields,
+        'tags': tags,
+        'time__gte': time__gte, 'time__lte': time__lte,
+        'received__gte': received__gte, 'received__lte': received__lte,
+        'limit': limit,
+        'interval': interval, 'interval_agg': interval_agg,
+    }
+
+    # Filter inside json
+    for key, value in kw.items():
+        if value is None:
+            params[key] = None
+            continue
+
+        if type(value) is datetime.datetime:
+            value = int(value.timestamp())
+
+        if isinstance(value, int):
+            key += ':int'
+
+        params[key] = value
+
+    return params
+
+
+def convert(data, format='pandas', time_index=True, schema=None, stats=None,
+            sparse_dtype=None):
+    """
+    Converts the data, as sent by the server, to the requested format. If a
+    schema is given (only with pandas), it's used to build the dataframe. If a
+    Stats object is given, the time to build the result, and to set the time
+    index, are added to it.
+
+    With pandas, data in the sparse format is built with sparse_to_pandas,
+    sparse_dtype defines how the missing values are represented.
+    """
+    t0 = time.perf_counter()
+    index = 0
+
+    if format == 'pandas':
+        import pandas as pd
+
+        if schema is not None:
+            if isinstance(schema, str):
+                schema = get_schema(schema)
+            data = schema.build(data)
+        elif data['format'] == 'arrow':
+            data = data['table'].to_pandas()
+        elif data['format'] == 'sparse':
+            data = sparse_to_pandas(data['rows'], sparse_dtype)
+        else:
+            data = pd.DataFrame(data['rows'], columns=data['columns'])
+
+        if time_index:
+            t1 = time.perf_counter()
+            try:
+                data.set_index(get_time_index(data['time']), inplace=True)
+            except (KeyError, TypeError, ValueError, OverflowError):
+                print('WARNING: no timestamp available. Set time_index=False')
+            index = time.perf_counter() - t1
+    elif format == 'arrow':
+        data = to_arrow(data, time_index)
+    elif format == 'polars':
+        data = to_polars(data, time_index)
+    elif format == 'json':
+        data = to_json(data)
+    else:
+        raise ValueError(f'unexpected format {format!r}')
+
+    if stats is not None:
+        stats.add(build=time.perf_counter() - t0 - index, index=index)
+
+    return data
+
+
+def sparse_to_pandas(rows, dtype=None):
+    """
+    Builds a pandas dataframe from the rows in the sparse format (a list of
+    dicts, every row with only some of the columns), like pd.json_normalize
+    but faster and leaner for wide sources with mostly missing values.
+
+    The keys and values of all the rows are collected in one pass (in C, with
+    itertools.chain), then every column is filled at once in a preallocated
+    array. The dtype defines how the missing values are represented:
+
+    - None, as pd.json_normalize: NaN, numeric columns with missing values
+      are float64, non numeric are object
+    - 'masked', pandas nullable types (Int64, Float64, boolean, string), so
+      integers stay integers
+    - 'sparse', pandas SparseDtype for the columns with missing values, only
+      the present values are stored
+
+    Nested dicts are flattened as pd.json_normalize does (a.b), falling back
+    to it.
+    """
+    import itertools
+    import numpy as np
+    import pandas as pd
+
+    if dtype not in (None, 'masked', 'sparse'):
+        raise ValueError(f'unexpected dtype {dtype!r}')
+
+    n = len(rows)
+    lengths = np.fromiter(map(len, rows), dtype='int64', count=n)
+    keys = np.empty(lengths.sum(), dtype=object)
+    keys[:] = list(itertools.chain.from_iterable(rows))
+    values = np.empty(len(keys), dtype=object)
+    values[:] = list(itertools.chain.from_iterable(map(dict.values, rows)))
+    index = np.repeat(np.arange(n), lengths)
+
+    # Explicit nulls are missing values as well
+    present = ~pd.isna(values)
+    codes, columns = pd.factorize(keys)
+    codes, values, index = codes[present], values[present], index[present]
+
+    # Group the values by column, keeping the order of the rows
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(columns) + 1))
+
+    data = {}
+    for i, name in enumerate(columns):
+        selection = order[bounds[i]:bounds[i + 1]]
+        column = values[selection]
+        types = set(map(type, column))
+        if dict in types:
+            return pd.json_normalize(rows)
+
+        data[name] = build_sparse_column(column, types, index[selection], n, dtype)
+
+    return pd.DataFrame(data, index=pd.RangeIndex(n))
+
+
+def build_sparse_column(values, types, index, n, dtype=None):
+    """
+    Returns the column of length n, with the values at the given positions,
+    see sparse_to_pandas.
+    """
+    import numpy as np
+    import pandas as pd
+
+    full = len(values) == n
+    mask = np.ones(n, dtype=bool)
+    mask[index] = False
+
+    kind = 'O'
+    if types and types <= {bool}:
+        kind = 'b'
+    elif types and types <= {int, float}:
+        kind = 'f' if float in types else 'i'
+        try:
+            values = values.astype('float64' if kind == 'f' else 'int64')
+        except OverflowError:
+            kind = 'O'
+
+    if full and kind != 'O':
+        array = np.empty(n, dtype=values.dtype if kind != 'b' else bool)
+        array[index] = values
+        return array
+
+    if dtype == 'masked' and kind != 'O':
+        array = np.zeros(n, dtype={'b': bool, 'i': 'int64', 'f': 'float64'}[kind])
+        array[index] = values
+        cls = {'b': pd.arrays.BooleanArray, 'i': pd.arrays.IntegerArray,
+               'f': pd.arrays.FloatingArray}[kind]
+        return cls(array, mask)
+
+    if kind in 'if':
+        array = np.full(n, np.nan)
+    else:
+        array = np.full(n, np.nan, dtype=object)
+    array[index] = values
+
+    if dtype == 'masked' and types <= {str}:
+        return pd.array(np.where(mask, None, array), dtype='string')
+
+    if dtype == 'sparse' and not full:
+        return pd.arrays.SparseArray(array, fill_value=np.nan)
+
+    return array
+
+
+def get_time_index(times):
+    """
+    Returns a DatetimeIndex named time, from the Unix timestamps. Integer
+    timestamps, the usual, are converted directly as int64 seconds, other
+    types are left to pd.to_datetime.
+    """
+    import numpy as np
+    import pandas as pd
+
+    values = np.asarray(times)
+    if values.dtype.kind in 'iu':
+        values = values.astype('int64', copy=False).astype('datetime64[s]')
+    else:
+        values = pd.to_datetime(values, unit='s')
+
+    return pd.DatetimeIndex(values, name='time')
+
+
+def to_json(data):
+    """
+    Returns the data as sent by the server in JSON. Data received in a binary
+    format is converted to the dense format.
+    """
+    if data['format'] != 'arrow':
+        return data
+
+    table = data['table']
+    columns = [column.to_pylist() for column in table.columns]
+    rows = [list(row) for row in zip(*columns)]
+    return {'format': 'dense', 'columns': table.column_names, 'rows': rows}
+
+
+def sparse_columns(rows):
+    """
+    Returns the names of the columns in the rows in the sparse format, the
+    keys of every row, in the order they're first seen.
+    """
+    import itertools
+
+    return list(dict.fromkeys(itertools.chain.from_iterable(rows)))
+
+
+def to_arrow(data, time_index=True):
+    """
+    Builds a pyarrow Table, column by column, from the data as sent by the
+    server. If time_index is true the time column is a timestamp.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if data['format'] == 'arrow':
+        table = data['table']
+    elif data['format'] == 'sparse':
+        # Not from_pylist, it takes the columns from the first row only
+        rows = data['rows']
+        table = pa.table({
+            name: pa.array([row.get(name) for row in rows])
+            for name in sparse_columns(rows)
+        })
+    else:
+        columns = data['columns']
+        arrays = list(zip(*data['rows'])) or [[] for name in columns]
+        table = pa.table({name: pa.array(array) for name, array in zip(columns, arrays)})
+
+    if time_index and 'time' in table.column_names:
+        i = table.column_names.index('time')
+        array = table.column(i)
+        if pa.types.is_floating(array.type):
+            array = pc.cast(pc.multiply(array, 1_000_000), pa.int64()).cast(pa.timestamp('us'))
+        elif pa.types.is_integer(array.type) or pa.types.is_null(array.type):
+            array = array.cast(pa.int64()).cast(pa.timestamp('s'))
+        table = table.set_column(i, 'time', array)
+
+    return table
+
+
+def to_polars(data, time_index=True):
+    """
+    Builds a polars DataFrame from the data as sent by the server. If
+    time_index is true the time column is a datetime.
+    """
+    import polars as pl
+
+    if data['format'] == 'arrow':
+        df = pl.from_arrow(data['table'])
+    elif data['format'] == 'sparse':
+        # Infer the schema from all the rows, not only the first ones
+        df = pl.from_dicts(data['rows'], infer_schema_length=None)
+    else:
+        df = pl.DataFrame(data['rows'], schema=data['columns'], orient='row')
+
+    if time_index and 'time' in df.columns:
+        if df['time'].dtype.is_float():
+            df = df.with_columns(pl.from_epoch(pl.col('time') * 1_000_000, time_unit='us'))
+        else:
+            df = df.with_columns(pl.from_epoch('time', time_unit='s'))
+
+    return df
+
+
+def split_range(time__gte, time__lte, chunk, interval=None):
+    """
+    Split the time range [time__gte, time__lte] (Unix timestamps) in chunks of
+    the given size (seconds). Returns a list of (start, end) tuples, the last
+    chunk is closed, the others are right-open.
+
+    If an interval is given the chunk size is rounded up to a multiple of the
+    interval, and the edges are aligned with the interval edges (multiples of
+    the interval since the Unix epoch), so no interval is split between two
+    chunks.
+    """
+    if isinstance(chunk, datetime.timedelta):
+        chunk = int(chunk.total_seconds())
+
+    if chunk <= 0:
+        raise ValueError('chunk must be positive')
+
+    if interval:
+        chunk = -(-chunk // interval) * interval
+
+    ranges = []
+    start = time__gte
+    while True:
+        end = (start // chunk + 1) * chunk
+        if end >= time__lte:
+            ranges.append((start, time__lte))
+            break
+
+        ranges.append((start, end))
+        start = end
+
+    return ranges
+
+
+def select(data, start=None, end=None):
+    """
+    Returns the data with only the rows within the time range [start, end).
+    """
+    if data['format'] == 'arrow':
+        import pyarrow.compute as pc
+
+        table = data['table']
+        if start is not None:
+            table = table.filter(pc.greater_equal(table.column('time'), start))
+        if end is not None:
+            table = table.filter(pc.less(table.column('time'), end))
+        return dict(data, table=table)
+
+    rows = data['rows']
+    if data['format'] == 'sparse':
+        get_time = lambda row: row['time']
+    else:
+        i = data['columns'].index('time')
+        get_time = lambda row: row[i]
+
+    if start is not None:
+        rows = [row for row in rows if get_time(row) >= start]
+    if end is not None:
+        rows = [row for row in rows if get_time(row) < end]
+
+    return dict(data, rows=rows)
+
+
+def merge(datas, limit=None):
+    """
+    Merges the data from consecutive time ranges into one. If all have the
+    same columns the result is dense, otherwise it's sparse.
+    """
+    if datas and all(data['format'] == 'arrow' for data in datas):
+        import pyarrow as pa
+
+        tables = [data['table'] for data in datas]
+        table = pa.concat_tables(tables, promote_options='default')
+        if limit is not None:
+            table = table.slice(0, limit)
+        return {'format': 'arrow', 'table': table}
+
+    datas = [to_json(data) for data in datas]
+    dense = all(data['format'] != 'sparse' for data in datas)
+    if dense:
+        columns = [data['columns'] for data in datas]
+        dense = all(x == columns[0] for x in columns)
+
+    rows = []
+    for data in datas:
+        if dense or data['format'] == 'sparse':
+            rows.extend(data['rows'])
+        else:
+            rows.extend(dict(zip(data['columns'], row)) for row in data['rows'])
+
+    if limit is not None:
+        rows = rows[:limit]
+
+    if dense and columns:
+        return {'format': 'dense', 'columns': columns[0], 'rows': rows}
+
+    return {'format': 'sparse', 'rows': rows}
+
+
+def get_times(data):
+    """
+    Returns the list of timestamps of the rows.
+    """
+    if data['format'] == 'arrow':
+        return data['table'].column('time').to_pylist()
+
+    if data['format'] == 'sparse':
+        return [row['time'] for row in data['rows']]
+
+    i = data['columns'].index('time')
+    return [row[i] for row in data['rows']]
+
+
+def head(data, n):
+    """
+    Returns the data with only the first n rows.
+    """
+    if data['format'] == 'arrow':
+        return dict(data, table=data['table'].slice(0, n))
+
+    return dict(data, rows=data['rows'][:n])
+
+
+def fetch(client, url, params, start, end, chunk=None, workers=4, interval=None,
+          closed=True, limit=None, stats=None, skip=None, stream=False):
+    """
+    Fetches the time range [start, end], or [start, end) if closed is False.
+    If chunk is given the range is split, and the chunks fetched concurrently.
+    The timings of the requests are added to stats, if given.
+
+    The skip function, if given, tells whether a chunk [start, end] is known
+    to be empty, then it is not fetched (see Coverage.get_filter). The stream
+    parameter is passed to client.get.
+
+    Returns the list of responses and the merged data.
+    """
+    if chunk is None:
+        ranges = [(start, end)]
+    else:
+        ranges = split_range(start, end, chunk, interval)
+
+    last = ranges[-1]
+    if skip is not None:
+        # Fetch at least one chunk, so the result has the server's format
+        ranges = [(a, b) for a, b in ranges if not skip(a, b)] or ranges[:1]
+
+    def fetch_range(start, end):
+        return client.get(url, dict(params, time__gte=start, time__lte=end), stats=stats,
+                          stream=stream)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_range, start, end) for start, end in ranges]
+        results = [future.result() for future in futures]
+
+    # Rows at the right edge of a chunk belong to the next one
+    datas = []
+    for i, (start, end) in enumerate(ranges):
+        response, data = results[i]
+        if (start, end) != last or not closed:
+            data = select(data, end=end)
+        datas.append(data)
+
+    responses = [response for response, data in results]
+    return responses, merge(datas, limit)
+
+
+def join_aggregates(frames):
+    """
+    Joins the dataframes of every aggregate (a dict agg: dataframe, with the
+    time column) into one dataframe, on the time, with (field, agg)
+    MultiIndex columns. The time column is kept as ('time', '').
+    """
+    import pandas as pd
+
+    fields = []
+    for agg, df in frames.items():
+        fields += [x for x in df.columns if x != 'time' and x not in fields]
+
+    df = pd.concat(
+        [df.set_index('time') for df in frames.values()],
+        axis=1, keys=list(frames), join='outer', sort=True,
+    )
+    df = df.swaplevel(axis=1)
+    columns = [(field, agg) for field in fields for agg in frames if (field, agg) in df.columns]
+    df = df[columns]
+
+    times = df.index.to_numpy()
+    df = df.reset_index(drop=True)
+    df.insert(0, ('time', ''), times)
+    return df
+
+
+def query_aggregates(db, interval_agg, format, time_index, client, **kw):
+    """
+    Runs one query per aggregate, concurrently, and joins the results, see
+    the interval_agg parameter of query().
+    """
+    if format != 'pandas':
+        raise ValueError('a list of aggregates requires format pandas')
+    if not kw.get('interval'):
+        raise ValueError('a list of aggregates requires interval')
+
+    def run(agg):
+        return query(db, interval_agg=agg, format='pandas', time_index=False, client=client, **kw)
+
+    aggs = list(dict.fromkeys(interval_agg))
+    with ThreadPoolExecutor(max_workers=len(aggs)) as executor:
+        futures = {agg: executor.submit(run, agg) for agg in aggs}
+        frames = {agg: future.result() for agg, future in futures.items()}
+
+    df = join_aggregates(frames)
+    if time_index:
+        df.set_index(get_time_index(df[('time', '')].to_numpy()), inplace=True)
+
+    return df
 
-# Prepare the session
-session = requests.Session()
-session.headers.update({'Authorization': f'Token {TOKEN}'})
 
 def query(
     db,                                     # postgresql or clickhouse
@@ -34,10 +560,21 @@ def query(
     time__gte=None, time__lte=None,         # Time range (sampled)
     received__gte=None, received__lte=None, # Time range (received)
     limit=100,                              # Limit
-    interval=None, interval_agg=None,       # Aggregates
-    format='pandas',                        # pandas or json
+    interval=None, interval_agg=None,       # Aggregates (interval_agg may be a list)
+    format='pandas',                        # pandas, json, arrow or polars
     time_index=True,                        # Return pandas dataframe with time as index
                                             # (only valid if format 'pandas' is selected)
+    schema=None,                            # Schema (or name) to build the pandas dataframe
+    sparse_dtype=None,                      # Missing values of sparse data (pandas): None (NaN),
+                                            # 'masked' (nullable dtypes) or 'sparse' (SparseDtype)
+    chunk=None, workers=4,                  # Split the time range in chunks (timedelta)
+                                            # fetched concurrently
+    stream=False,                           # Decode JSON while downloading (True or 'process')
+    cache=None,                             # Cache object (or path) to store the results
+    coverage=None,                          # Coverage object (or path) to skip empty chunks
+    memo=None,                              # MemoryCache to keep the results in memory
+    client=None,                            # WSNClient, the default one if not given
+    hook=None,                              # Called with the Stats of the call
     debug=False,
     **kw                                    # postgresql filters (name, serial, ...)
     ):
@@ -77,7 +614,17 @@ def query(
     If the fields parameter is not given, all the fields will be returned. This
     is only recommended to explore the available columns, because it may be too
     slow and add a lot of work on the servers. So it is recommended to ask only
-    for the fields you need, it will be much faster.
+    for the fields you need, it will be much faster. To explore the available
+    columns use instead describe (see wsn_client.describe), which is cheap and
+    cached:
+
+        describe('postgresql', name='eddypro_Finseflux')['columns']
+
+    Once a source is described, the fields requested are validated before
+    sending the request: unknown fields are an error with ClickHouse (a
+    warning once the description has expired), and a warning with PostgreSQL.
+    And a warning is printed if fields is not given and the source has many
+    columns.
 
     Examples:
 
@@ -167,6 +714,93 @@ def query(
     If using clickhouse any aggregate function supported by ClickHouse can be
     used, see https://clickhouse-docs.readthedocs.io/en/latest/agg_functions/
 
+    To get several aggregates at once pass a list, e.g.
+    interval_agg=['avg', 'min', 'max', 'stddev']. The server computes one
+    aggregate per request, so one request per aggregate is sent, all at the
+    same time. The result is a single dataframe (format must be pandas), with
+    (field, agg) MultiIndex columns, e.g. ('LWIN_6_14_1_1_1', 'avg'), and the
+    time column (beginning of the interval) as ('time', ''):
+
+        df = query(..., interval=3600, interval_agg=['avg', 'min', 'max'])
+        df['LWIN_6_14_1_1_1']['max']
+        df.xs('avg', axis=1, level=1)
+
+    Fetching long time ranges
+    ===========================
+
+    A long time range at full resolution returns a huge response, it may take
+    minutes to download, or even time out. Pass the chunk parameter to split
+    the time range in smaller chunks, which are fetched concurrently, and then
+    merged in a single time-ordered result.
+
+    The chunk parameter is a timedelta (or a number of seconds), the workers
+    parameter defines how many chunks are fetched at the same time. The
+    time__gte parameter is required, if time__lte is not given it defaults to
+    now.
+
+    Example:
+
+        query(
+            'clickhouse', table='finseflux_Biomet',
+            fields=['LWIN_6_14_1_1_1', 'LWOUT_6_15_1_1_1'],
+            time__gte=datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc),
+            time__lte=datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc),
+            limit=None,
+            chunk=datetime.timedelta(days=1), workers=8,
+        )
+
+    When used with intervals the chunk edges are aligned with the interval
+    edges, so every interval is computed by a single chunk. The limit applies
+    to the merged result, not to every chunk.
+
+    Many sources have long gaps without data. Pass the coverage parameter, a
+    Coverage object or a path, to skip the chunks known to be empty, see
+    wsn_client.coverage. The days not counted in the coverage index are
+    always fetched.
+
+    By default a JSON response is decoded once fully downloaded. With
+    stream=True it's decoded while downloaded, row by row, and the dense rows
+    are gathered in column buffers (Arrow arrays, if pyarrow is installed),
+    so download and decoding overlap, and the peak memory is lower. With
+    stream='process' the decoding is done by a worker process, which pays off
+    with responses of hundreds of megabytes, see wsn_client.stream.
+
+    Caching results
+    ===========================
+
+    Pass the cache parameter, a Cache object or a path, to store the results
+    on disk. The cache remembers which time ranges have been already fetched
+    for the same query (database, table, fields, tags, filters and interval),
+    and only the missing ranges will be requested to the server.
+
+    Example:
+
+        cache = Cache('~/.cache/wsn_client', ttl=datetime.timedelta(hours=1))
+        query(
+            'clickhouse', table='finseflux_Biomet',
+            fields=['LWIN_6_14_1_1_1', 'LWOUT_6_15_1_1_1'],
+            time__gte=datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc),
+            time__lte=datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc),
+            limit=None,
+            cache=cache,
+        )
+
+    Historical data is cached forever, while the data close to the time it was
+    fetched (see the recent parameter of Cache) expires after the ttl, because
+    more data may arrive later.
+
+    The time__gte parameter is required, if time__lte is not given it defaults
+    to now. The missing ranges are always fetched in full, the limit only
+    applies to the result. The cache can be combined with the chunk parameter.
+
+    A process that runs the same queries many times, maybe concurrently from
+    several threads, may instead keep the results in memory. Pass the memo
+    parameter, a MemoryCache object; concurrent identical queries then share a
+    single request, and every caller gets its own copy of the result:
+
+        memo = MemoryCache(maxsize=512 * 2**20, ttl=datetime.timedelta(minutes=5))
+        query(..., memo=memo)
+
     Tags (PostgreSQL only)
     ===========================
 
@@ -193,77 +827,171 @@ def query(
     This function returns by default a Pandas dataframe. Use format='json' to
     return instead a Python dictionary, with the data as was sent by the server.
 
-    Debugging
+    With format='pandas' the schema parameter may be given, a Schema object or
+    the name of a schema in wsn_client.schema.SCHEMAS (e.g. 'CR6_biomet_perm').
+    Then the dataframe is built with the data types of the schema (e.g.
+    float32 for measurements, category for metadata strings), and the columns
+    renamed to their short names. See wsn_client.schema.
+
+    Data from PostgreSQL is usually sparse: every row has only some of the
+    fields. By default the missing values are NaN, as with pd.json_normalize;
+    pass sparse_dtype='masked' to use pandas nullable types instead (so
+    integers stay integers), or sparse_dtype='sparse' to use SparseDtype for
+    the columns with missing values, which uses much less memory with wide,
+    mostly empty, sources.
+
+    Use format='arrow' to return a pyarrow Table, or format='polars' to return
+    a polars DataFrame. These are built directly from the data, without an
+    intermediate pandas dataframe, and are faster for large results. The
+    time column is a timestamp, unless time_index=False.
+
+    Client
     ===========================
 
-    With debug=True this function will print some information, useful for
-    testing. Default is False.
-    """
-
-    t0 = time.perf_counter()
+    By default the host and token are read from the WSN_HOST and WSN_TOKEN
+    environment variables. Pass the client parameter to use a different host,
+    or to tune the connection pool, retries and timeout:
 
-    url = f'{HOST}/api/query/{db}/'
+        client = WSNClient(pool_maxsize=64, retries=5, timeout=300)
+        query(..., client=client)
 
-    # Parameters
-    to_timestamp = lambda x: int(x.timestamp()) if x else x
-    time__gte = to_timestamp(time__gte)
-    time__lte = to_timestamp(time__lte)
-    received__gte = to_timestamp(received__gte)
-    received__lte = to_timestamp(received__lte)
+    Statistics
+    ===========================
 
-    if interval_agg == 'mean':
-        interval_agg = 'avg'
+    Every call collects a wsn_client.stats.Stats object, with the time spent
+    connecting, waiting for the server, downloading, decoding the body,
+    building the result and setting the time index, plus the bytes and rows
+    returned. Pass the hook parameter, a function, to get it:
 
-    params = {
-        'table': table,
-        'fields': fields,
-        'tags': tags,
-        'time__gte': time__gte, 'time__lte': time__lte,
-        'received__gte': received__gte, 'received__lte': received__lte,
-        'limit': limit,
-        'interval': interval, 'interval_agg': interval_agg,
-    }
+        stats = []
+        query(..., hook=stats.append)
 
-    # Filter inside json
-    for key, value in kw.items():
-        if value is None:
-            params[key] = None
-            continue
+    The statistics are as well aggregated in client.metrics, by database and
+    table (or name), and can be exported with client.metrics.to_prometheus()
+    or client.metrics.to_statsd().
 
-        if type(value) is datetime.datetime:
-            value = int(value.timestamp())
+    Debugging
+    ===========================
 
-        if isinstance(value, int):
-            key += ':int'
+    With debug=True this function will print some information, useful for
+    testing. Default is False.
+    """
 
-        params[key] = value
+    t0 = time.perf_counter()
 
-    # Query
-    response = session.get(url, params=params)
-    response.raise_for_status()
-    json = response.json()
+    if client is None:
+        client = get_client()
+
+    url = client.url(f'/api/query/{db}/')
+
+    if memo is not None:
+        key = memo.get_key(url, table, fields, tags, time__gte, time__lte, received__gte,
+                           received__lte, limit, interval, interval_agg, format, time_index,
+                           schema, sparse_dtype, kw)
+        return memo.get(key, lambda: query(
+            db, table=table, fields=fields, tags=tags,
+            time__gte=time__gte, time__lte=time__lte,
+            received__gte=received__gte, received__lte=received__lte,
+            limit=limit, interval=interval, interval_agg=interval_agg,
+            format=format, time_index=time_index, schema=schema, sparse_dtype=sparse_dtype,
+            chunk=chunk, workers=workers, stream=stream, cache=cache, coverage=coverage,
+            client=client, hook=hook, debug=debug, **kw
+        ))
+
+    # Validate the fields against the cached description, if any
+    from .describe import validate
+    validate(db, table, fields, client, **kw)
+
+    # Several aggregates, one query per aggregate
+    if isinstance(interval_agg, (list, tuple)):
+        return query_aggregates(
+            db, interval_agg, format, time_index, client,
+            table=table, fields=fields, tags=tags,
+            time__gte=time__gte, time__lte=time__lte,
+            received__gte=received__gte, received__lte=received__lte,
+            limit=limit, interval=interval, schema=schema, sparse_dtype=sparse_dtype,
+            chunk=chunk, workers=workers, stream=stream, cache=cache, coverage=coverage,
+            hook=hook, debug=debug, **kw
+        )
 
-    data = json
-    if format == 'pandas':
-        if data['format'] == 'sparse':
-            data = pd.json_normalize(data['rows'])
-        else:
-            data = pd.DataFrame(data['rows'], columns=data['columns'])
+    stats = Stats(db=db, table=table or kw.get('name'))
 
+    skip = None
+    if coverage is not None:
+        if isinstance(coverage, str):
+            from .coverage import Coverage
+            coverage = Coverage(coverage)
+        skip = coverage.get_filter(db, table, **kw)
 
-        if time_index:
-            try:
-                data.set_index(pd.to_datetime(data.time, unit='s'), inplace=True)
-            except:
-                print('WARNING: no timestamp available. Set time_index=False')
+    # Parameters
+    params = get_params(
+        table=table, fields=fields, tags=tags,
+        time__gte=time__gte, time__lte=time__lte,
+        received__gte=received__gte, received__lte=received__lte,
+        limit=limit, interval=interval, interval_agg=interval_agg,
+        **kw
+    )
+    time__gte = params['time__gte']
+    time__lte = params['time__lte']
 
-    t1 = time.perf_counter()
+    # Query
+    if cache is not None:
+        if time__gte is None:
+            raise ValueError('cache requires time__gte')
+        if time__lte is None:
+            time__lte = int(time.time())
+
+        if isinstance(cache, str):
+            cache = Cache(cache)
+
+        # The cache works with right-open ranges, and stores full ranges. The
+        # partial intervals at the edges are not cached
+        key = cache.get_key(url, params)
+        cached, edges = align(time__gte, time__lte + 1, interval)
+        chunk_params = dict(params, limit=None)
+        responses = []
+        parts = {}
+        for start, end in edges:
+            edge_responses, parts[start] = fetch(client, url, chunk_params, start, end,
+                                                 closed=False, stats=stats, stream=stream)
+            responses.extend(edge_responses)
+
+        if cached is not None:
+            for start, end in cache.missing(key, *cached, interval):
+                chunk_responses, chunk_data = fetch(client, url, chunk_params, start, end,
+                                                    chunk, workers, interval, closed=False,
+                                                    stats=stats, skip=skip, stream=stream)
+                cache.store(key, start, end, chunk_data)
+                responses.extend(chunk_responses)
+
+            parts[cached[0]] = cache.load(key, *cached)
+
+        json = merge([parts[start] for start in sorted(parts)], limit)
+    elif chunk is None:
+        response, json = client.get(url, params, stats=stats, stream=stream)
+        responses = [response]
+    else:
+        if time__gte is None:
+            raise ValueError('chunk requires time__gte')
+        if time__lte is None:
+            time__lte = int(time.time())
+
+        responses, json = fetch(client, url, params, time__gte, time__lte, chunk,
+                                workers, interval, limit=limit, stats=stats, skip=skip,
+                                stream=stream)
+
+    data = convert(json, format, time_index, schema, stats, sparse_dtype)
+
+    stats.add(total=time.perf_counter() - t0, rows=get_rows(data))
+    client.metrics.record(stats)
+    if hook is not None:
+        hook(stats)
 
     # Debug
     if debug:
-        size = response.headers['Content-Length']
-        print(f'{response.request.url}')
-        print(f'Returns {size} bytes in {(t1-t0):.2f} seconds')
+        for response in responses:
+            print(f'{response.request.url}')
+        print(f'Returns {stats}')
         #import pprint; pprint.pprint(json)
         print()
         print(data)
@@ -272,6 +1000,174 @@ def query(
     return data
 
 
+def iter_query(
+    db,                                     # postgresql or clickhouse
+    table=None,                             # clickhouse table name
+    fields=None,                            # Fields to return: all by default
+    tags=None,                              # postgresql metadata fields (none by default)
+    time__gte=None, time__lte=None,         # Time range (sampled)
+    received__gte=None, received__lte=None, # Time range (received)
+    limit=None,                             # Limit (all pages)
+    interval=None, interval_agg=None,       # Aggregates
+    format='pandas',                        # pandas, json, arrow or polars
+    time_index=True,                        # Return pandas dataframe with time as index
+                                            # (only valid if format 'pandas' is selected)
+    schema=None,                            # Schema (or name) to build the pandas dataframe
+    sparse_dtype=None,                      # Missing values of sparse data (pandas): None (NaN),
+                                            # 'masked' (nullable dtypes) or 'sparse' (SparseDtype)
+    page_size=10000,                        # Maximum number of rows per page
+    client=None,                            # WSNClient, the default one if not given
+    debug=False,
+    **kw                                    # postgresql filters (name, serial, ...)
+    ):
+    """
+    iter_query('clickhouse', table='', ...) -> iterator of dataframes or dicts
+    iter_query('postgresql', ...) -> iterator of dataframes or dicts
+
+    Like query, but instead of returning all the rows at once, it pages
+    through the result and yields one page at a time, so memory use is
+    bounded by the page size. Every page is a separate request to the server,
+    and starts after the last time seen in the previous page. See query for
+    the documentation of the parameters.
+
+    Note that the limit is None by default, and that a page may have fewer
+    rows than page_size: without intervals, the rows that share the last
+    timestamp of a page are moved to the next page, so no row is lost or
+    repeated.
+
+    Example:
+
+        for df in iter_query(
+            'clickhouse', table='finseflux_Biomet',
+            time__gte=datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc),
+            time__lte=datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc),
+            page_size=50000,
+        ):
+            df.to_csv('data.csv', mode='a')
+    """
+
+    if client is None:
+        client = get_client()
+
+    url = client.url(f'/api/query/{db}/')
+
+    params = get_params(
+        table=table, fields=fields, tags=tags,
+        time__gte=time__gte, time__lte=time__lte,
+        received__gte=received__gte, received__lte=received__lte,
+        limit=limit, interval=interval, interval_agg=interval_agg,
+        **kw
+    )
+
+    cursor = params['time__gte']
+    while limit is None or limit > 0:
+        t0 = time.perf_counter()
+
+        size = page_size if limit is None else min(page_size, limit)
+        response, json = client.get(url, dict(params, time__gte=cursor, limit=size))
+        times = get_times(json)
+        last = len(times) < size or size == limit
+
+        if not last and times:
+            if interval:
+                # Every row is a full interval, continue with the next one
+                cursor = (times[-1] // interval + 1) * interval
+            else:
+                # Move the rows with the last timestamp to the next page
+                n = len(times)
+                while n > 0 and times[n - 1] == times[-1]:
+                    n -= 1
+
+                if n > 0:
+                    cursor = times[-1]
+                    times = times[:n]
+                    json = head(json, n)
+                else:
+                    print(f'WARNING: more than {size} rows at time {times[-1]}, some are lost')
+                    cursor = times[-1] + 1
+
+        if limit is not None:
+            limit -= len(times)
+
+        data = convert(json, format, time_index, schema, sparse_dtype=sparse_dtype)
+        del response, json, times
+
+        if debug:
+            print(f'Page of {len(data["rows"]) if format == "json" else len(data)} rows '
+                  f'in {(time.perf_counter()-t0):.2f} seconds')
+
+        yield data
+        del data
+
+        if last:
+            break
+
+
+def query_many(specs, workers=8, merge=False, client=None, **kw):
+    """
+    query_many(specs, ...) -> (results, errors)
+
+    Runs many queries concurrently, over the connection pool of the client.
+    The specs is a dictionary with the parameters of query() for every
+    source, e.g.
+
+        results, errors = query_many(
+            {
+                'sw-001': {'db': 'postgresql', 'name': 'sw-001'},
+                'fw-001': {'db': 'postgresql', 'name': 'fw-001'},
+                'biomet': {'db': 'clickhouse', 'table': 'finseflux_Biomet'},
+            },
+            fields=['bat'],
+            time__gte=datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc),
+            limit=None,
+        )
+
+    The specs can be as well a list, then the keys are the positions in the
+    list. The keyword arguments are the parameters shared by all the queries,
+    the specs override them.
+
+    Returns a dictionary with the result of every query that succeeded, and a
+    dictionary with the exception of every query that failed. So a failing
+    query does not abort the others.
+
+    With merge=True the results (which must be dataframes) are concatenated
+    in one dataframe, ordered by time, with a source column with the key of
+    the spec.
+    """
+    if client is None:
+        client = get_client()
+
+    if not isinstance(specs, dict):
+        specs = dict(enumerate(specs))
+
+    def run(spec):
+        return query(**dict(kw, client=client, **spec))
+
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {key: executor.submit(run, spec) for key, spec in specs.items()}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as exc:
+                errors[key] = exc
+
+    if merge:
+        import pandas as pd
+
+        frames = [df.assign(source=key) for key, df in results.items()]
+        if frames:
+            results = pd.concat(frames)
+            if 'time' in results.columns:
+                order = results['time'].to_numpy().argsort(kind='stable')
+                results = results.iloc[order]
+        else:
+            results = pd.DataFrame()
+
+    return results, errors
+
+
 if __name__ == '__main__':
     time_left = datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc)
     time_right = datetime.datetime(2018, 4, 1, tzinfo=datetime.timezone.utc)
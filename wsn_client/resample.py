@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+from .query import get_time_index
+
+
+AGGREGATES = ['avg', 'count', 'max', 'min', 'stddev', 'sum', 'variance']
+
+
+def resample(df, interval, agg=None, time_index=True):
+    """
+    resample(df, interval, agg=None) -> dataframe
+
+    Splits the rows of a dataframe returned by query() in intervals, and
+    returns one row per interval, like query() does with the interval and
+    interval_agg parameters, but locally. So, once the raw data has been
+    fetched, different intervals and aggregates can be explored without
+    going back to the server:
+
+        df = query('clickhouse', table='finseflux_Biomet', fields=[...],
+                   time__gte=..., time__lte=..., limit=None)
+        hourly = resample(df, 3600, 'avg')
+        daily_max = resample(df, 3600 * 24, 'max')
+
+    The interval is the size in seconds, the intervals are left-closed and
+    right-open, and aligned to multiples of the interval since the Unix epoch.
+
+    Without agg the first row within every interval is returned, the time
+    column is that of the first row.
+
+    With agg the aggregate of every column within the interval is returned,
+    the time column is the beginning of the interval. The aggregates are
+    those of PostgreSQL: avg (or mean), count, max, min, stddev, sum and
+    variance; stddev and variance are those of the sample. As in SQL, null
+    values (NaN) are ignored, and only numeric columns are aggregated (all
+    the columns are counted).
+
+    The dataframe must have the time column (Unix timestamps), as returned
+    by query(). If time_index is true the result has the time as index.
+    """
+    if agg == 'mean':
+        agg = 'avg'
+
+    if agg is not None and agg not in AGGREGATES:
+        raise ValueError(f'unexpected aggregate {agg!r}, choices are {AGGREGATES}')
+
+    times = df['time'].to_numpy()
+    if len(times) > 1 and (np.diff(times) < 0).any():
+        order = np.argsort(times, kind='stable')
+        df = df.iloc[order]
+        times = times[order]
+
+    # Index of the first row of every interval
+    bins = times // interval * interval
+    starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+    starts = starts if len(times) else starts[:0]
+
+    if agg is None:
+        data = df.iloc[starts].reset_index(drop=True)
+    else:
+        if agg == 'count':
+            columns = [x for x in df.columns if x != 'time']
+            values = np.where(df[columns].notna().to_numpy(), 1.0, np.nan)
+        else:
+            columns = [
+                x for x in df.columns
+                if x != 'time' and pd.api.types.is_numeric_dtype(df[x])
+            ]
+            values = df[columns].to_numpy(dtype=float)
+
+        values = values.reshape(len(times), len(columns))
+        data = aggregate(values, starts, agg)
+        data = pd.DataFrame(data, columns=columns)
+        data.insert(0, 'time', bins[starts])
+
+    if time_index:
+        data.set_index(get_time_index(data['time']), inplace=True)
+
+    return data
+
+
+def aggregate(values, starts, agg):
+    """
+    Computes the aggregate of the 2D array of values (rows x columns), for
+    every group of rows beginning at the given starts. NaN are ignored.
+    """
+    if len(starts) == 0:
+        return values[:0]
+
+    valid = ~np.isnan(values)
+    n = np.add.reduceat(valid, starts, axis=0)
+    if agg == 'count':
+        return n
+
+    if agg == 'min':
+        return np.fmin.reduceat(values, starts, axis=0)
+
+    if agg == 'max':
+        return np.fmax.reduceat(values, starts, axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+        total[n == 0] = np.nan
+        if agg == 'sum':
+            return total
+
+        mean = total / n
+        if agg == 'avg':
+            return mean
+
+        # Two passes, more accurate than the sum of squares
+        lengths = np.diff(np.append(starts, len(values)))
+        deviation = values - np.repeat(mean, lengths, axis=0)
+        squares = np.add.reduceat(np.where(valid, deviation ** 2, 0), starts, axis=0)
+        variance = squares / (n - 1)
+        variance[n < 2] = np.nan
+        if agg == 'variance':
+            return variance
+
+        return np.sqrt(variance)
@@ -0,0 +1,156 @@
+"""
+Schema registry, built from the variable dictionaries in var_dict. A schema
+knows, for every column, the short name to rename it to, and its data type.
+
+    schema = get_schema('CR6_biomet_perm', float_dtype='float32')
+    df = query('clickhouse', table='finseflux_Biomet', ..., schema=schema)
+
+Or just:
+
+    df = query('clickhouse', table='finseflux_Biomet', ..., schema='CR6_biomet_perm')
+"""
+
+from . import var_dict
+
+
+class Schema:
+    """
+    Schema(names, dtypes, float_dtype='float64', duplicates='suffix')
+
+    The names is a dictionary mapping the column names to the short names,
+    the dtypes a dictionary mapping the column names to the data types:
+    'float' for measurements (the precision is given by float_dtype), 'int64'
+    (nullable Int64 if there are missing values), 'category', or any other
+    numpy/pandas data type.
+
+    Several columns may have the same short name in the dictionaries (e.g.
+    RH_19_3_1_1_1 and RH_19_3_1_2_1 are both 'rh'), the duplicates parameter
+    defines how this is handled:
+
+    - 'suffix' add a suffix to every duplicate, by order: rh_1, rh_2
+    - 'error' raise a ValueError
+    - 'keep' keep the original column names of the duplicates
+
+    The short name '__' means there is no short name, the column keeps its
+    name.
+    """
+
+    def __init__(self, names, dtypes, float_dtype='float64', duplicates='suffix'):
+        if duplicates not in ('suffix', 'error', 'keep'):
+            raise ValueError(f'unexpected duplicates {duplicates!r}')
+
+        self.float_dtype = float_dtype
+        self.dtypes = dict(dtypes)
+        self.names = {}
+
+        targets = {}
+        for name, target in names.items():
+            if target == '__':
+                target = name
+            targets.setdefault(target, []).append(name)
+
+        for target, sources in targets.items():
+            if len(sources) == 1:
+                self.names[sources[0]] = target
+            elif duplicates == 'error':
+                raise ValueError(f'columns {sources} have the same name {target!r}')
+            elif duplicates == 'suffix':
+                for i, name in enumerate(sources, 1):
+                    self.names[name] = f'{target}_{i}'
+            else:
+                for name in sources:
+                    self.names[name] = name
+
+        # The short names must not clash with the names of other columns
+        clashes = set(self.names.values()) & (set(names) - {
+            name for name, target in self.names.items() if target == name
+        })
+        if clashes:
+            raise ValueError(f'short names {sorted(clashes)} clash with column names')
+
+    def get_dtype(self, name):
+        dtype = self.dtypes.get(name)
+        if dtype == 'float':
+            return self.float_dtype
+        return dtype
+
+    def rename(self, columns):
+        return [self.names.get(name, name) for name in columns]
+
+    def build_column(self, name, values):
+        """
+        Returns the column as a typed array. The columns not in the schema are
+        inferred by pandas, floats are converted to the float_dtype.
+        """
+        import numpy as np
+        import pandas as pd
+
+        dtype = self.get_dtype(name)
+        if dtype == 'category':
+            return pd.Categorical(values)
+
+        if dtype == 'int64':
+            try:
+                return np.array(values, dtype='int64')
+            except (TypeError, ValueError):
+                return pd.array(values, dtype='Int64')
+
+        if dtype is not None:
+            return np.array(values, dtype=dtype)
+
+        array = pd.Series(values).to_numpy()
+        if array.dtype.kind == 'f':
+            array = array.astype(self.float_dtype, copy=False)
+        return array
+
+    def build(self, data):
+        """
+        Builds a pandas dataframe, with typed columns and the short names, from
+        the data as sent by the server.
+        """
+        import pandas as pd
+
+        if data['format'] == 'dense':
+            columns = data['columns']
+            arrays = list(zip(*data['rows'])) or [[] for name in columns]
+            return pd.DataFrame({
+                target: self.build_column(name, array)
+                for name, target, array in zip(columns, self.rename(columns), arrays)
+            })
+
+        if data['format'] == 'arrow':
+            df = data['table'].to_pandas()
+        else:
+            from .query import sparse_to_pandas
+            df = sparse_to_pandas(data['rows'])
+
+        return self.apply(df)
+
+    def apply(self, df):
+        """
+        Converts the data types, and renames the columns, of a pandas dataframe.
+        """
+        import pandas as pd
+
+        df = pd.DataFrame({name: self.build_column(name, df[name]) for name in df.columns})
+        df.columns = self.rename(df.columns)
+        return df
+
+
+# Registry, the names of the schemas are those of the dictionaries in var_dict
+SCHEMAS = {
+    'CR6_biomet_perm': (var_dict.CR6_biomet_perm, var_dict.CR6_biomet_perm_dtype),
+    'CR6_biomet_mobile': (var_dict.CR6_biomet_mobile, var_dict.CR6_biomet_mobile_dtype),
+}
+
+
+def get_schema(name, float_dtype='float64', duplicates='suffix'):
+    """
+    Returns the schema with the given name, see SCHEMAS for the choices.
+    """
+    try:
+        names, dtypes = SCHEMAS[name]
+    except KeyError:
+        raise ValueError(f'unknown schema {name!r}, choices are {list(SCHEMAS)}')
+
+    return Schema(names, dtypes, float_dtype=float_dtype, duplicates=duplicates)
@@ -0,0 +1,148 @@
+"""
+Timing and size statistics of the queries.
+
+Every call to query() collects a Stats object, with the time spent in every
+phase and the bytes and rows returned. Pass a hook to get it:
+
+    stats = []
+    df = query(..., hook=stats.append)
+    print(stats[0])
+
+The stats are as well aggregated in the metrics of the client, which can be
+exported in the Prometheus text format or as StatsD lines:
+
+    client = get_client()
+    print(client.metrics.to_prometheus())
+"""
+
+import threading
+
+
+class Stats:
+    """
+    Statistics of one call. The times are in seconds:
+
+    - connect: DNS resolution and connection (TCP and TLS), 0 if the
+      connection was reused from the pool
+    - wait: from sending the request to receiving the response headers
+    - download: reading the body
+    - decode: parsing the body (JSON, MessagePack or Arrow)
+    - build: building the result (dataframe, table, ...)
+    - index: converting the time column to the pandas index
+    - total: wall time of the call
+
+    With several requests (chunks, pages), connect, wait, download and decode
+    are the sums over the requests, so with concurrent requests they may add
+    up to more than the total.
+
+    The bytes are those transferred (compressed), the size is that of the
+    body once decompressed, the rows those returned.
+    """
+
+    TIMES = ('connect', 'wait', 'download', 'decode', 'build', 'index', 'total')
+    COUNTS = ('requests', 'bytes', 'size', 'rows')
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.lock = threading.Lock()
+        for name in self.TIMES:
+            setattr(self, name, 0.0)
+        for name in self.COUNTS:
+            setattr(self, name, 0)
+
+    def add(self, **values):
+        with self.lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.TIMES + self.COUNTS}
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={value!r}' for name, value in self.as_dict().items())
+        return f'Stats({values})'
+
+    def __str__(self):
+        times = ' '.join(f'{name}={getattr(self, name):.3f}' for name in self.TIMES)
+        return (f'{self.requests} requests, {self.bytes} bytes ({self.size} decoded), '
+                f'{self.rows} rows; seconds: {times}')
+
+
+def get_rows(data):
+    """
+    Returns the number of rows of the result, whatever the format.
+    """
+    if isinstance(data, dict):
+        if data['format'] == 'arrow':
+            return data['table'].num_rows
+        return len(data['rows'])
+
+    return len(data)
+
+
+class Metrics:
+    """
+    Counters aggregated over all the calls, by labels (db and table).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def record(self, stats):
+        labels = tuple(sorted((k, str(v)) for k, v in stats.labels.items() if v is not None))
+        with self.lock:
+            counters = self.counters.get(labels)
+            if counters is None:
+                names = ('calls',) + Stats.TIMES + Stats.COUNTS
+                counters = self.counters[labels] = dict.fromkeys(names, 0)
+
+            counters['calls'] += 1
+            for name, value in stats.as_dict().items():
+                counters[name] += value
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+
+    def items(self):
+        with self.lock:
+            return [(dict(labels), dict(counters)) for labels, counters in self.counters.items()]
+
+    def to_prometheus(self, prefix='wsn_client'):
+        """
+        Returns the counters in the Prometheus text exposition format.
+        """
+        items = self.items()
+        lines = []
+        for name in ('calls',) + Stats.TIMES + Stats.COUNTS:
+            unit = '_seconds' if name in Stats.TIMES else ''
+            metric = f'{prefix}_{name}{unit}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for labels, counters in items:
+                labels = ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+                labels = f'{{{labels}}}' if labels else ''
+                lines.append(f'{metric}{labels} {counters[name]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def to_statsd(self, prefix='wsn_client'):
+        """
+        Returns the counters as StatsD lines, the times in milliseconds. The
+        labels are added as DogStatsD tags.
+        """
+        lines = []
+        for labels, counters in self.items():
+            tags = ','.join(f'{k}:{v}' for k, v in labels.items())
+            tags = f'|#{tags}' if tags else ''
+            for name, value in counters.items():
+                if name in Stats.TIMES:
+                    lines.append(f'{prefix}.{name}_ms:{round(value * 1000)}|c{tags}')
+                else:
+                    lines.append(f'{prefix}.{name}:{value}|c{tags}')
+
+        return lines
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
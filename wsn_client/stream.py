@@ -0,0 +1,321 @@
+"""
+Incremental decoding of JSON responses, while they are downloaded:
+
+    parser = Parser()
+    for chunk in response.iter_content(CHUNK_SIZE):
+        parser.feed(chunk)
+    data = parser.close()
+
+The rows array is decoded row by row as the bytes arrive. Rows in the dense
+format are gathered in column buffers, an Arrow record batch per chunk
+(requires pyarrow), so the decoded Python objects are freed as soon as
+possible. Otherwise the rows are kept as they are.
+
+The decoding can as well be done by a worker process (see decode_response),
+so download and decoding run on different cores.
+"""
+
+import codecs
+import importlib.util
+import json
+import json.scanner
+import re
+
+
+# Bytes read from the response at a time
+CHUNK_SIZE = 2**20
+
+# Whitespace, and the commas between the rows
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+SEPARATOR = re.compile(r'[ \t\n\r,]*')
+
+
+class Parser:
+    """
+    Push parser of the JSON object returned by the server, {"format": ...,
+    "columns": [...], "rows": [...]} in any order. The members other than
+    rows are decoded as a whole, they are small.
+
+    Returns, when closed, the data in the dense or sparse format, or in the
+    arrow format if the rows were gathered in column buffers.
+    """
+
+    def __init__(self, columnar=None):
+        if columnar is None:
+            columnar = importlib.util.find_spec('pyarrow') is not None
+
+        self.columnar = columnar
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.scan = json.scanner.make_scanner(json.JSONDecoder())
+        self.buffer = ''
+        self.state = 'start'
+        self.key = None
+        self.data = {}
+        self.rows = []          # Rows not yet gathered in column buffers
+        self.batches = []       # Column buffers (Arrow record batches)
+
+    def feed(self, chunk, final=False):
+        self.buffer += self.decoder.decode(chunk, final)
+        pos = self.parse(self.buffer, final)
+        self.buffer = self.buffer[pos:]
+        self.gather()
+
+    def close(self):
+        self.feed(b'', final=True)
+        if self.state != 'end' or self.buffer.strip():
+            raise ValueError('unexpected end of the JSON document')
+
+        data = self.data
+        if self.columnar and self.batches:
+            table = self.concat()
+            if table is not None:
+                return {'format': 'arrow', 'table': table}
+
+        data['rows'] = self.rows
+        if 'format' not in data:
+            data['format'] = 'sparse' if self.rows and isinstance(self.rows[0], dict) else 'dense'
+
+        return data
+
+    def parse(self, text, final):
+        """
+        Parses as much of the text as possible, returns the position where the
+        next call must continue.
+        """
+        n = len(text)
+        pos = 0
+        while True:
+            pos = WHITESPACE.match(text, pos).end()
+            if pos == n:
+                return pos
+
+            state = self.state
+            char = text[pos]
+            if state == 'rows':
+                pos = self.parse_rows(text, pos, final)
+                if self.state == 'rows':
+                    return pos
+            elif state == 'start':
+                self.expect(char, '{')
+                self.state = 'key'
+                pos += 1
+            elif state == 'key':
+                if char == '}':
+                    self.state = 'end'
+                    pos += 1
+                    continue
+                key, end = self.decode(text, pos, final)
+                if end is None:
+                    return pos
+                self.key = key
+                self.state = 'colon'
+                pos = end
+            elif state == 'colon':
+                self.expect(char, ':')
+                self.state = 'value'
+                pos += 1
+            elif state == 'value':
+                if self.key == 'rows':
+                    self.expect(char, '[')
+                    self.state = 'rows'
+                    pos += 1
+                    continue
+                value, end = self.decode(text, pos, final)
+                if end is None:
+                    return pos
+                self.data[self.key] = value
+                self.state = 'next'
+                pos = end
+            elif state == 'next':
+                if char == ',':
+                    self.state = 'key'
+                elif char == '}':
+                    self.state = 'end'
+                else:
+                    self.expect(char, ', or }')
+                pos += 1
+            else:
+                raise ValueError(f'unexpected {char!r} after the end of the JSON document')
+
+    def parse_rows(self, text, pos, final):
+        """
+        Parses the rows, the hot loop.
+        """
+        scan = self.scan
+        match = SEPARATOR.match
+        append = self.rows.append
+        n = len(text)
+        while True:
+            pos = match(text, pos).end()
+            if pos == n:
+                return pos
+            if text[pos] == ']':
+                self.state = 'next'
+                return pos + 1
+            try:
+                row, pos2 = scan(text, pos)
+            except (StopIteration, json.JSONDecodeError):
+                # Incomplete, unless final
+                if final:
+                    raise ValueError(f'invalid JSON row at {text[pos:pos+20]!r}')
+                return pos
+            append(row)
+            pos = pos2
+
+    def decode(self, text, pos, final):
+        """
+        Decodes a value, returns (value, None) if incomplete.
+        """
+        try:
+            value, end = self.scan(text, pos)
+        except (StopIteration, json.JSONDecodeError):
+            if final:
+                raise ValueError(f'invalid JSON at {text[pos:pos+20]!r}')
+            return None, None
+
+        # A number at the end of the text may continue in the next chunk
+        if end == len(text) and not final and isinstance(value, (int, float)):
+            return None, None
+
+        return value, end
+
+    def expect(self, char, expected):
+        if char not in expected:
+            raise ValueError(f'unexpected {char!r} in the JSON document, expected {expected}')
+
+    def gather(self):
+        """
+        Moves the rows decoded to the column buffers, if they are dense and
+        the columns are known.
+        """
+        rows = self.rows
+        if not self.columnar or not rows or 'columns' not in self.data:
+            return
+
+        if not isinstance(rows[0], list):
+            self.columnar = False
+            return
+
+        import pyarrow as pa
+
+        columns = self.data['columns']
+        try:
+            arrays = [pa.array(values) for values in zip(*rows)]
+            if len(arrays) != len(columns):
+                raise ValueError('rows and columns do not match')
+            batch = pa.RecordBatch.from_arrays(arrays, names=columns)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError):
+            # Mixed types, keep the rows as they are
+            self.ungather()
+            return
+
+        self.batches.append(batch)
+        self.rows = []
+
+    def concat(self):
+        import pyarrow as pa
+
+        try:
+            tables = [pa.Table.from_batches([batch]) for batch in self.batches]
+            return pa.concat_tables(tables, promote_options='permissive')
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            self.ungather()
+            return None
+
+    def ungather(self):
+        """
+        Moves the rows back from the column buffers, and stops gathering.
+        """
+        rows = [list(row.values()) for batch in self.batches for row in batch.to_pylist()]
+        self.rows = rows + self.rows
+        self.batches = []
+        self.columnar = False
+
+
+def read(response, parser, size=CHUNK_SIZE):
+    """
+    Feeds the body of the response to the parser, returns the size of the
+    body (decompressed).
+    """
+    total = 0
+    for chunk in response.iter_content(size):
+        parser.feed(chunk)
+        total += len(chunk)
+
+    return total
+
+
+def worker(connection, columnar):
+    """
+    Runs in the worker process: decodes the chunks received through the
+    connection, until an empty one, and sends back the data. Arrow tables are
+    sent in the Arrow IPC format.
+    """
+    parser = Parser(columnar)
+    try:
+        while True:
+            chunk = connection.recv_bytes()
+            if not chunk:
+                break
+            parser.feed(chunk)
+
+        data = parser.close()
+    except Exception as exc:
+        connection.send(('error', exc))
+        return
+
+    if data['format'] == 'arrow':
+        import pyarrow as pa
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, data['table'].schema) as writer:
+            writer.write_table(data['table'])
+        connection.send(('arrow', None))
+        connection.send_bytes(sink.getvalue())
+    else:
+        connection.send(('json', data))
+
+
+def decode_response(response, process=False, size=CHUNK_SIZE):
+    """
+    Downloads and decodes the JSON response at the same time, returns the
+    data and the size of the body (decompressed).
+
+    With process=True the decoding is done by a worker process, the chunks
+    are sent to it as they arrive. As with any use of multiprocessing, the
+    main module must be importable without side effects (use the
+    if __name__ == '__main__' guard).
+    """
+    if not process:
+        parser = Parser()
+        total = read(response, parser, size)
+        return parser.close(), total
+
+    import multiprocessing
+
+    columnar = importlib.util.find_spec('pyarrow') is not None
+    context = multiprocessing.get_context('spawn')
+    connection, child = context.Pipe()
+    process = context.Process(target=worker, args=(child, columnar))
+    process.start()
+    child.close()
+    try:
+        total = 0
+        for chunk in response.iter_content(size):
+            connection.send_bytes(chunk)
+            total += len(chunk)
+        connection.send_bytes(b'')
+
+        kind, data = connection.recv()
+        if kind == 'error':
+            raise data
+        if kind == 'arrow':
+            import pyarrow as pa
+
+            table = pa.ipc.open_stream(connection.recv_bytes()).read_all()
+            data = {'format': 'arrow', 'table': table}
+    finally:
+        connection.close()
+        process.join()
+
+    return data, total
@@ -68,6 +68,67 @@ CR6_biomet_perm = {'BEC_99_99_3_1_1':               'bec',
 
 CR6_biomet_perm_unit = {}
 
+# Data types: float for measurements (see wsn_client.schema for the
+# precision), category for metadata strings that repeat in every row
+CR6_biomet_perm_dtype = {
+    'BEC_99_99_3_1_1':                 'float',
+    'CS650PERIOD_99_99_3_1_1':         'float',
+    'CS650VRATIO_99_99_3_1_1':         'float',
+    'FC1DRIFTmax_99_99_1_1_1':         'float',
+    'FC1DRIFTmean_99_99_1_1_1':        'float',
+    'FC1DRIFTmin_99_99_1_1_1':         'float',
+    'FC1DRIFTstd_99_99_1_1_1':         'float',
+    'FC1DRIFTsum_99_99_1_1_1':         'float',
+    'FC1WSmax_16_99_1_1_1':            'float',
+    'FC1WSmean_16_99_1_1_1':           'float',
+    'FC1WSmin_16_99_1_1_1':            'float',
+    'FC2DRIFTmax_99_99_1_1_1':         'float',
+    'FC2DRIFTmean_99_99_1_1_1':        'float',
+    'FC2DRIFTmin_99_99_1_1_1':         'float',
+    'FC2DRIFTstd_99_99_1_1_1':         'float',
+    'FC2DRIFTsum_99_99_1_1_1':         'float',
+    'FC2WSmax_16_99_1_1_1':            'float',
+    'FC2WSmean_16_99_1_1_1':           'float',
+    'FC2WSmin_16_99_1_1_1':            'float',
+    'LWIN_6_14_1_1_1':                 'float',
+    'LWOUT_6_15_1_1_1':                'float',
+    'METNORA_99_99_1_1_1':             'float',
+    'METNORR_99_99_1_1_1':             'float',
+    'METNOR_99_99_1_1_1':              'float',
+    'METNOS_99_99_1_1_1':              'float',
+    'PA_4_2_1_1_1':                    'float',
+    'PERMITTIVITY_99_99_3_1_1':        'float',
+    'RECORD':                          'int64',
+    'RH_19_3_1_1_1':                   'float',
+    'RH_19_3_1_2_1':                   'float',
+    'SHF_6_37_1_1_1':                  'float',
+    'SHF_6_37_2_1_1':                  'float',
+    'SHF_99_37_1_1_1':                 'float',
+    'SHF_99_37_1_1_2':                 'float',
+    'SHF_99_37_2_1_1':                 'float',
+    'SHF_99_37_2_1_2':                 'float',
+    'SWC_12_36_3_1_1':                 'float',
+    'SWIN_6_10_1_1_1':                 'float',
+    'SWOUT_6_11_1_1_1':                'float',
+    'TA_2_1_1_1_1':                    'float',
+    'TA_2_1_1_2_1':                    'float',
+    'TSS_2_99_1_1_1':                  'float',
+    'TS_2_38_1_1_1':                   'float',
+    'TS_2_38_2_1_1':                   'float',
+    'TS_2_38_3_1_1':                   'float',
+    'VIN_18_39_1_1_1':                 'float',
+    'WD_20_35_1_1_1':                  'float',
+    'WS_16_33_1_1_1':                  'float',
+    'model':                           'category',
+    'name':                            'category',
+    'os_version':                      'category',
+    'prog_name':                       'category',
+    'prog_signature':                  'category',
+    'serial':                          'int64',
+    'table_name':                      'category',
+    'time':                            'int64',
+}
+
 CR6_biomet_perm_description = {}
 
 CR6_biomet_mobile = {
@@ -96,3 +157,30 @@ CR6_biomet_mobile = {
     'TS 2 38 3 1 1':                'ts',
     'VIN 18 39 1 1 1':              'vin',
 }
+
+CR6_biomet_mobile_dtype = {
+    'BEC 99 99 3 1 1':              'float',
+    'CS650PERIOD 99 99 3 1 1':      'float',
+    'CS650VRATIO 99 99 3 1 1':      'float',
+    'LWIN 6 14 1 1 1':              'float',
+    'LWOUT 6 15 1 1 1':             'float',
+    'PA 4 2 1 1 1':                 'float',
+    'PERMITTIVITY 99 99 3 1 1':     'float',
+    'P RAIN 8 19 1 1 1':            'float',
+    'RECORD':                       'int64',
+    'RH 19 3 1 1 1':                'float',
+    'SHF 6 37 1 1 1':               'float',
+    'SHF 6 37 2 1 1':               'float',
+    'SHF 99 37 1 1 2':              'float',
+    'SHF 99 37 2 1 2':              'float',
+    'SR50DISTANCE 9 99 1 1 1':      'float',
+    'SR50QUALITY 99 99 1 1 1':      'float',
+    'SURFACETEMP 2 99 1 1 1':       'float',
+    'SWC 12 36 3 1 1':              'float',
+    'SWIN 6 10 1 1 1':              'float',
+    'SWOUT 6 11 1 1 1':             'float',
+    'TA 2 1 1 1 1':                 'float',
+    'TS 2 38 2 1 1':                'float',
+    'TS 2 38 3 1 1':                'float',
+    'VIN 18 39 1 1 1':              'float',
+}